@@ -0,0 +1,26 @@
+"""adds board_data for binary boards.
+
+Revision ID: 3c7e1f2a9d04
+Revises: b263810e388a
+Create Date: 2026-10-18 14:02:11.402871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7e1f2a9d04'
+down_revision = 'b263810e388a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('boards', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('board_data', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('boards', schema=None) as batch_op:
+        batch_op.drop_column('board_data')
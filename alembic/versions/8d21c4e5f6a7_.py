@@ -0,0 +1,40 @@
+"""adds game versions and token move numbers.
+
+Revision ID: 8d21c4e5f6a7
+Revises: 3c7e1f2a9d04
+Create Date: 2026-10-18 15:20:43.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d21c4e5f6a7'
+down_revision = '3c7e1f2a9d04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('move_count', sa.Integer(), nullable=True))
+    with op.batch_alter_table('tokens', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('move_number', sa.Integer(), nullable=True))
+
+    # Existing tokens were placed in token_id order.
+    op.execute(
+        'UPDATE tokens SET move_number = ('
+        'SELECT COUNT(*) FROM tokens AS earlier '
+        'WHERE earlier.game_id = tokens.game_id '
+        'AND earlier.token_id <= tokens.token_id)')
+    op.execute(
+        'UPDATE games SET move_count = ('
+        'SELECT COUNT(*) FROM tokens WHERE tokens.game_id = games.game_id)')
+
+
+def downgrade():
+    with op.batch_alter_table('tokens', schema=None) as batch_op:
+        batch_op.drop_column('move_number')
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.drop_column('move_count')
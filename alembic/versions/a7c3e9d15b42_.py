@@ -0,0 +1,74 @@
+"""replaces game_status_json with status columns.
+
+Revision ID: a7c3e9d15b42
+Revises: f1a6d2b83c90
+Create Date: 2026-10-18 18:03:51.226147
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d15b42'
+down_revision = 'f1a6d2b83c90'
+branch_labels = None
+depends_on = None
+
+# game_complete already has a column.
+STATUS_COLUMNS = ('to_move', 'moves_left', 'border_full',
+                  'connections_remaining', 'score_1', 'score_2')
+STATUS_KEYS = ('to_move', 'moves_left', 'border_full',
+               'connections_remaining', 'game_complete', 'score_1', 'score_2')
+
+
+def upgrade():
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('to_move', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('moves_left', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('border_full', sa.Boolean(create_constraint=False), nullable=True))
+        batch_op.add_column(sa.Column('connections_remaining', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('score_1', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('score_2', sa.Integer(), nullable=True))
+
+    connection = op.get_bind()
+    games = connection.execute(sa.text(
+        'SELECT game_id, game_status_json FROM games')).fetchall()
+    update = sa.text(
+        'UPDATE games SET ' + ', '.join('%s = :%s' % (c, c) for c in STATUS_COLUMNS)
+        + ', game_complete = :game_complete WHERE game_id = :game_id')
+    for game_id, game_status_json in games:
+        status = json.loads(game_status_json)
+        values = {column: status.get(column) for column in STATUS_COLUMNS}
+        values['game_complete'] = bool(status.get('game_complete'))
+        values['game_id'] = game_id
+        connection.execute(update, values)
+
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.drop_column('game_status_json')
+
+
+def downgrade():
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('game_status_json', sa.String(), nullable=True))
+
+    connection = op.get_bind()
+    games = connection.execute(sa.text(
+        'SELECT game_id, ' + ', '.join(STATUS_KEYS) + ' FROM games')).fetchall()
+    for row in games:
+        status = {key: value for key, value in zip(STATUS_KEYS, row[1:])
+                  if value is not None}
+        if not status.get('game_complete'):
+            status.pop('game_complete', None)
+        for key in ('border_full', 'game_complete'):
+            if key in status:
+                status[key] = bool(status[key])
+        connection.execute(sa.text(
+            'UPDATE games SET game_status_json = :status WHERE game_id = :game_id'),
+            {'status': json.dumps(status), 'game_id': row[0]})
+
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        for column in reversed(STATUS_COLUMNS):
+            batch_op.drop_column(column)
@@ -0,0 +1,73 @@
+"""adds replay checkpoints and an index on the move log.
+
+Revision ID: c5d8e2f47a19
+Revises: a7c3e9d15b42
+Create Date: 2026-10-18 19:26:40.518734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d8e2f47a19'
+down_revision = 'a7c3e9d15b42'
+branch_labels = None
+depends_on = None
+
+# The default REPLAY_CHECKPOINT_INTERVAL.  Replays start from the latest
+# checkpoint at or before the move asked for, so a different setting only
+# changes the spacing of checkpoints written later.
+INTERVAL = 32
+
+
+def next_turn(to_move, moves_left):
+    if moves_left > 1:
+        return to_move, moves_left - 1
+    return (2 if to_move == 1 else 1), 2
+
+
+def upgrade():
+    op.create_table('checkpoints',
+        sa.Column('game_id', sa.Integer(), nullable=False),
+        sa.Column('move_number', sa.Integer(), nullable=False),
+        sa.Column('cells', sa.LargeBinary(), nullable=True),
+        sa.Column('to_move', sa.Integer(), nullable=True),
+        sa.Column('moves_left', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['game_id'], ['games.game_id'], name=op.f('fk_checkpoints_game_id_games')),
+        sa.PrimaryKeyConstraint('game_id', 'move_number', name=op.f('pk_checkpoints'))
+    )
+    with op.batch_alter_table('tokens', schema=None) as batch_op:
+        batch_op.create_index('ix_tokens_game_id_move_number', ['game_id', 'move_number'], unique=False)
+
+    # Checkpoints for the games already played, from their move logs.
+    connection = op.get_bind()
+    games = connection.execute(sa.text(
+        'SELECT games.game_id, boards.num_cells FROM games '
+        'JOIN boards ON boards.board_id = games.board_id')).fetchall()
+    insert = sa.text(
+        'INSERT INTO checkpoints (game_id, move_number, cells, to_move, moves_left) '
+        'VALUES (:game_id, :move_number, :cells, :to_move, :moves_left)')
+    for game_id, num_cells in games:
+        tokens = connection.execute(sa.text(
+            'SELECT location, player FROM tokens WHERE game_id = :game_id '
+            'ORDER BY move_number, token_id'), {'game_id': game_id}).fetchall()
+        cells = bytearray(num_cells)
+        turn = (1, 1)
+        for move_number, (location, player) in enumerate(tokens, 1):
+            cells[location] = player
+            turn = next_turn(*turn)
+            if move_number % INTERVAL == 0:
+                connection.execute(insert, {
+                    'game_id': game_id,
+                    'move_number': move_number,
+                    'cells': bytes(cells),
+                    'to_move': turn[0],
+                    'moves_left': turn[1],
+                })
+
+
+def downgrade():
+    with op.batch_alter_table('tokens', schema=None) as batch_op:
+        batch_op.drop_index('ix_tokens_game_id_move_number')
+    op.drop_table('checkpoints')
@@ -0,0 +1,81 @@
+"""adds indexes for hot queries and unique token placement.
+
+Revision ID: e4b9a1c07d35
+Revises: 8d21c4e5f6a7
+Create Date: 2026-10-18 16:05:27.530916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9a1c07d35'
+down_revision = '8d21c4e5f6a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the first token placed on each cell, so the unique index applies.
+    op.execute(
+        'DELETE FROM tokens WHERE token_id NOT IN ('
+        'SELECT MIN(token_id) FROM tokens GROUP BY game_id, location)')
+    # Close the gaps that leaves in the move log, so that each game's moves
+    # are numbered 1 to move_count again.  The new numbers are worked out in
+    # a scratch table first, since they depend on the old ones.
+    op.execute(
+        'CREATE TEMPORARY TABLE renumbered AS '
+        'SELECT token_id, ('
+        'SELECT COUNT(*) FROM tokens AS earlier '
+        'WHERE earlier.game_id = tokens.game_id '
+        'AND (earlier.move_number < tokens.move_number '
+        'OR (earlier.move_number = tokens.move_number '
+        'AND earlier.token_id <= tokens.token_id))) AS move_number '
+        'FROM tokens')
+    op.execute(
+        'UPDATE tokens SET move_number = ('
+        'SELECT move_number FROM renumbered '
+        'WHERE renumbered.token_id = tokens.token_id)')
+    op.execute('DROP TABLE renumbered')
+    op.execute(
+        'UPDATE games SET move_count = ('
+        'SELECT COUNT(*) FROM tokens WHERE tokens.game_id = games.game_id)')
+    # Signups used to race, so a username may be taken twice; all but the
+    # first such user get their user_id appended, and a counter too if that
+    # name is taken, so the unique index applies.
+    connection = op.get_bind()
+    taken = {row[0] for row in connection.execute(sa.text('SELECT username FROM users'))}
+    duplicates = connection.execute(sa.text(
+        'SELECT user_id, username FROM users WHERE user_id NOT IN ('
+        'SELECT MIN(user_id) FROM users GROUP BY username) '
+        'ORDER BY user_id')).fetchall()
+    for user_id, username in duplicates:
+        new_username = '%s-%d' % (username, user_id)
+        counter = 1
+        while new_username in taken:
+            counter += 1
+            new_username = '%s-%d-%d' % (username, user_id, counter)
+        taken.add(new_username)
+        connection.execute(sa.text(
+            'UPDATE users SET username = :username WHERE user_id = :user_id'),
+            {'username': new_username, 'user_id': user_id})
+    with op.batch_alter_table('tokens', schema=None) as batch_op:
+        batch_op.create_index('ix_tokens_game_id_location', ['game_id', 'location'], unique=True)
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_games_board_id'), ['board_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_games_player1_id'), ['player1_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_games_player2_id'), ['player2_id'], unique=False)
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_users_username'), ['username'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_username'))
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_games_player2_id'))
+        batch_op.drop_index(batch_op.f('ix_games_player1_id'))
+        batch_op.drop_index(batch_op.f('ix_games_board_id'))
+    with op.batch_alter_table('tokens', schema=None) as batch_op:
+        batch_op.drop_index('ix_tokens_game_id_location')
@@ -0,0 +1,57 @@
+"""adds board sizes and game completion for filtered listings.
+
+Revision ID: f1a6d2b83c90
+Revises: e4b9a1c07d35
+Create Date: 2026-10-18 17:12:09.402816
+
+"""
+import json
+import struct
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a6d2b83c90'
+down_revision = 'e4b9a1c07d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('boards', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('num_cells', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_boards_num_cells'), ['num_cells'], unique=False)
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('game_complete', sa.Boolean(create_constraint=False), nullable=True))
+        batch_op.create_index(batch_op.f('ix_games_game_complete'), ['game_complete'], unique=False)
+
+    connection = op.get_bind()
+    boards = connection.execute(sa.text(
+        'SELECT board_id, board_data, board_json FROM boards')).fetchall()
+    for board_id, board_data, board_json in boards:
+        if board_data is not None:
+            # num_cells follows the magic and two uint16s in the header.
+            num_cells, = struct.unpack_from('<I', board_data, 8)
+        else:
+            num_cells = len(json.loads(board_json)['tokens'])
+        connection.execute(sa.text(
+            'UPDATE boards SET num_cells = :num_cells WHERE board_id = :board_id'),
+            {'num_cells': num_cells, 'board_id': board_id})
+    games = connection.execute(sa.text(
+        'SELECT game_id, game_status_json FROM games')).fetchall()
+    for game_id, game_status_json in games:
+        game_complete = bool(json.loads(game_status_json).get('game_complete'))
+        connection.execute(sa.text(
+            'UPDATE games SET game_complete = :game_complete WHERE game_id = :game_id'),
+            {'game_complete': game_complete, 'game_id': game_id})
+
+
+def downgrade():
+    with op.batch_alter_table('games', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_games_game_complete'))
+        batch_op.drop_column('game_complete')
+    with op.batch_alter_table('boards', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_boards_num_cells'))
+        batch_op.drop_column('num_cells')
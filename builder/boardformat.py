@@ -0,0 +1,110 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Binary board format.  A board is a 24-byte header followed by four
+# little-endian arrays, each starting on an 8-byte boundary:
+#
+#   header   magic b'VORB', uint16 version, uint16 flags,
+#            uint32 num_cells, uint32 num_border, uint32 num_edges,
+#            uint32 reserved
+#   coords   float64[num_cells, 2]
+#   edges    int32[num_edges, 2]
+#   indptr   int32[num_cells + 1]    CSR adjacency, both directions
+#   indices  int32[2 * num_edges]
+#
+# With the NO_ADJACENCY flag the last two arrays are left out, as they are
+# for the geometry sent to browsers, which only draw the board.
+#
+# decode() returns NumPy views into the buffer without copying, so boards
+# can be read straight from a bytes object such as a database blob.
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'VORB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIII')
+NO_ADJACENCY = 1
+
+COORD_DTYPE = np.dtype('<f8')
+INDEX_DTYPE = np.dtype('<i4')
+
+def _padded(size):
+    return (size + 7) & ~7
+
+def is_binary(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+def adjacency(num_cells, edges):
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(num_cells + 1, dtype=np.intp)
+    np.cumsum(np.bincount(sources, minlength=num_cells), out=indptr[1:])
+    return indptr, targets[order]
+
+def encode(tokens, edges, num_border, with_adjacency=True):
+    coords = np.asarray(tokens, dtype=COORD_DTYPE).reshape(-1, 2)
+    edges = np.asarray(edges, dtype=INDEX_DTYPE).reshape(-1, 2)
+    flags = 0 if with_adjacency else NO_ADJACENCY
+    parts = [
+        HEADER.pack(MAGIC, VERSION, flags, len(coords), num_border, len(edges), 0),
+        coords.tobytes(),
+        edges.tobytes(),
+    ]
+    if with_adjacency:
+        indptr, indices = adjacency(len(coords), edges)
+        parts += [indptr.astype(INDEX_DTYPE).tobytes(),
+                  indices.astype(INDEX_DTYPE).tobytes()]
+    return b''.join(part + b'\0' * (_padded(len(part)) - len(part))
+                    for part in parts)
+
+def decode(data):
+    # Boards without the adjacency get it computed.
+    magic, version, flags, num_cells, num_border, num_edges, _ = (
+        HEADER.unpack_from(data))
+    if magic != MAGIC:
+        raise ValueError('Not a binary board')
+    if version != VERSION:
+        raise ValueError('Unsupported board format version %d' % version)
+    offset = _padded(HEADER.size)
+    sections = [('coords', COORD_DTYPE, num_cells * 2, (-1, 2)),
+                ('edges', INDEX_DTYPE, num_edges * 2, (-1, 2))]
+    if not flags & NO_ADJACENCY:
+        sections += [('indptr', INDEX_DTYPE, num_cells + 1, (-1,)),
+                     ('indices', INDEX_DTYPE, num_edges * 2, (-1,))]
+    arrays = {}
+    for name, dtype, count, shape in sections:
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=count,
+                                     offset=offset).reshape(shape)
+        offset += _padded(count * dtype.itemsize)
+    if flags & NO_ADJACENCY:
+        arrays['indptr'], arrays['indices'] = adjacency(num_cells, arrays['edges'])
+    arrays['num_border'] = num_border
+    return arrays
+
+def to_json_dict(board):
+    return {
+        'tokens': board['coords'].tolist(),
+        'edges': board['edges'].tolist(),
+        'num_border': board['num_border'],
+    }
+
+def read_any(data):
+    # Accepts either format as bytes, returning the JSON-style dict.
+    if is_binary(data):
+        return to_json_dict(decode(data))
+    return json.loads(data)
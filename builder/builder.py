@@ -14,12 +14,18 @@
 # limitations under the License.
 
 import click
+import concurrent.futures
 import numpy as np
 from scipy.spatial import Delaunay, Voronoi
+import itertools
 import math
+import os
+import time
 import datetime
 import json
 
+from builder import boardformat
+
 
 def centroid(points):
     area = 0.0
@@ -33,7 +39,42 @@ def centroid(points):
     return pta / (area * 3)
 
 
-def cvcirc(pts, n, r):
+def polygon_centroids(vertices, regions):
+    # Centroids of many polygons at once, given as lists of vertex indices.
+    # Each vertex is paired with its predecessor (the first with the last),
+    # exactly as in centroid(), and the per-polygon sums use reduceat.
+    lengths = np.fromiter(map(len, regions), dtype=np.intp, count=len(regions))
+    flat = np.fromiter(itertools.chain.from_iterable(regions), dtype=np.intp,
+                       count=int(lengths.sum()))
+    starts = np.zeros(len(regions), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    prev = np.arange(len(flat)) - 1
+    prev[starts] = starts + lengths - 1
+    x = vertices[flat[prev]]
+    y = vertices[flat]
+    wt = x[:, 0]*y[:, 1] - y[:, 0]*x[:, 1]
+    area = np.add.reduceat(wt, starts)
+    pta = np.add.reduceat((x+y) * wt[:, None], starts)
+    return pta / (area[:, None] * 3)
+
+
+def cvcirc(pts, n, r, circ=None):
+    # Centroids of the finite Voronoi cells of pts, in the order of pts;
+    # points whose cell is unbounded are dropped.
+    if circ is None:
+        circ = circle(n)
+    pts_aug = np.concatenate([pts, circ * r])
+    vor = Voronoi(pts_aug)
+    regions = [vor.regions[k] for k in vor.point_region[:len(pts)]]
+    regions = [region for region in regions
+               if len(region) > 0 and -1 not in region]
+    if not regions:
+        return np.empty([0, 2])
+    return polygon_centroids(vor.vertices, regions)
+
+
+def cvcirc_reference(pts, n, r):
+    # The original per-vertex implementation, kept for benchmarks.
     circ = np.array([[math.cos(2*math.pi*i/n), math.sin(2*math.pi*i/n)]
                      for i in range(n)])
     pts_aug = np.concatenate([pts, circ * r])
@@ -44,12 +85,35 @@ def cvcirc(pts, n, r):
          if len(region) > 0 and -1 not in region])
 
 
-def voroboard(n_i, n_b, ic):
-    rng = np.random.default_rng()
+ALGORITHMS = {
+    # Plain Lloyd iteration: every point moves to its cell's centroid.
+    'lloyd': 1.0,
+    # Over-relaxed Lloyd: points overshoot the centroid, which reaches a
+    # given tolerance in roughly half the iterations on boards like ours.
+    'overrelaxed': 1.8,
+}
+
+
+def voroboard(n_i, n_b, ic, tolerance=None, algorithm='lloyd', rng=None):
+    # Returns the relaxed interior points and the number of iterations run.
+    # With a tolerance, stops once no point moved further than it.
+    omega = ALGORITHMS[algorithm]
+    if rng is None:
+        rng = np.random.default_rng()
     pts = rng.standard_normal([n_i, 2])
-    for unused_i in range(ic):
+    circ = circle(n_b)
+    iterations = 0
+    while iterations < ic:
+        iterations += 1
         n_c = len(pts)
-        pts = cvcirc(pts, n_b, 20)
+        centroids = cvcirc(pts, n_b, 20, circ)
+        if len(centroids) == n_c:
+            steps = centroids - pts
+            pts = pts + omega * steps
+            shift = np.sqrt((steps ** 2).sum(axis=1).max())
+        else:
+            pts = centroids
+            shift = math.inf
         if len(pts) < n_c:
             print('small: ', len(pts))
             n_a = n_c - len(pts)
@@ -57,21 +121,24 @@ def voroboard(n_i, n_b, ic):
         if len(pts) > n_c:
             print('big: ', len(pts))
             pts = pts[:n_c]
-        for j in range(n_c):
-            if np.linalg.norm(pts[j]) > 19.75:
-                pts[j] = rng.standard_normal([2]) * 4
-    return pts
+        outside = np.linalg.norm(pts, axis=1) > 19.75
+        if outside.any():
+            pts[outside] = rng.standard_normal([np.count_nonzero(outside), 2]) * 4
+            shift = math.inf
+        if tolerance is not None and shift < tolerance:
+            break
+    return pts, iterations
 
 
 def circle(n):
     return np.array([[math.cos(2*math.pi*i/n), math.sin(2*math.pi*i/n)] for i in range(n)])
 
-@click.command()
-@click.option('--border', type=int, default=51, help='Number of tokens to have on the border of the board.')
-@click.option('--interior', type=int, default=310, help='Number of tokens to have in the interior of the board.')
-@click.argument('output', type=click.File('w'))
-def build_board(border, interior, output):
-    board = voroboard(interior, border, 800)
+def make_board(border, interior, iterations, tolerance, algorithm, seed):
+    # Builds one board from a seed; the same arguments give the same board.
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    board, iterations_run = voroboard(interior, border, iterations,
+                                      tolerance, algorithm, rng)
     trueboard = np.concatenate([circle(border) * 20, board])
     delb = Delaunay(trueboard)
 
@@ -79,13 +146,105 @@ def build_board(border, interior, output):
     edges = {(int(i), int(j)) for i in range(len(trueboard))
             for j in indices[ptr[i]:ptr[i+1]]
             if i < j}
-    
+
     res = {
         'tokens': trueboard.tolist(),
-        'edges': list(edges),
+        'edges': sorted(edges),
         'num_border': border,
     }
-    json.dump(res, output)
+    return res, iterations_run, time.perf_counter() - start
+
+
+FORMATS = {
+    'json': ('.json', 'w'),
+    'binary': ('.vorb', 'wb'),
+}
+
+
+def write_board(res, f, output_format):
+    if output_format == 'binary':
+        f.write(boardformat.encode(res['tokens'], res['edges'], res['num_border']))
+    else:
+        json.dump(res, f)
+
+
+def child_seeds(seed, count):
+    # Each board gets its own seed, usable with --seed to rebuild just it.
+    return [int(child.generate_state(1, np.uint64)[0])
+            for child in np.random.SeedSequence(seed).spawn(count)]
+
+
+def build_batch(count, jobs, seed, output_dir, output_format, board_args):
+    os.makedirs(output_dir, exist_ok=True)
+    seeds = child_seeds(seed, count)
+    extension, mode = FORMATS[output_format]
+    names = ['board-%04d%s' % (i, extension) for i in range(count)]
+    manifest = []
+    start = time.perf_counter()
+
+    def finished(index, result):
+        res, iterations_run, seconds = result
+        with open(os.path.join(output_dir, names[index]), mode) as f:
+            write_board(res, f, output_format)
+        manifest.append({
+            'file': names[index],
+            'seed': seeds[index],
+            'iterations': iterations_run,
+            'seconds': seconds,
+        })
+        click.echo('[%d/%d] %s seed=%d: %d iterations in %.2fs' % (
+            len(manifest), count, names[index], seeds[index],
+            iterations_run, seconds), err=True)
+
+    if jobs == 1:
+        for index in range(count):
+            finished(index, make_board(*board_args, seeds[index]))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(make_board, *board_args, seeds[index]): index
+                       for index in range(count)}
+            for future in concurrent.futures.as_completed(futures):
+                finished(futures[future], future.result())
+
+    manifest.sort(key=lambda entry: entry['file'])
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump({'seed': seed, 'boards': manifest}, f, indent=1)
+    total = time.perf_counter() - start
+    click.echo('%d boards in %.2fs (%.2fs/board of worker time)' % (
+        count, total, sum(entry['seconds'] for entry in manifest) / count),
+        err=True)
+
+
+@click.command()
+@click.option('--border', type=int, default=51, help='Number of tokens to have on the border of the board.')
+@click.option('--interior', type=int, default=310, help='Number of tokens to have in the interior of the board.')
+@click.option('--iterations', type=int, default=800, help='Maximum number of relaxation iterations.')
+@click.option('--tolerance', type=float, default=None,
+              help='Stop once no point moves further than this in an iteration.')
+@click.option('--algorithm', type=click.Choice(sorted(ALGORITHMS)), default='lloyd',
+              help='Relaxation method used to approach the centroidal tessellation.')
+@click.option('--seed', type=int, default=None,
+              help='Random seed; the batch seed when --count is above 1.')
+@click.option('--count', type=int, default=1,
+              help='Number of boards to build; above 1, OUTPUT is a directory.')
+@click.option('--jobs', type=int, default=1, help='Worker processes for batch builds.')
+@click.option('--format', 'output_format', type=click.Choice(sorted(FORMATS)),
+              default='json', help='Board file format.')
+@click.argument('output', type=click.Path())
+def build_board(border, interior, iterations, tolerance, algorithm, seed,
+                count, jobs, output_format, output):
+    board_args = (border, interior, iterations, tolerance, algorithm)
+    if count > 1:
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+            click.echo('Batch seed: %d' % seed, err=True)
+        build_batch(count, jobs, seed, output, output_format, board_args)
+        return
+    res, iterations_run, seconds = make_board(*board_args, seed)
+    click.echo('%s: %d iterations in %.2fs' % (
+        algorithm, iterations_run, seconds), err=True)
+    with click.open_file(output, FORMATS[output_format][1]) as f:
+        write_board(res, f, output_format)
 
 if __name__ == "__main__":
-    build_board() # pylint: disable=no-value-for-parameter
\ No newline at end of file
+    build_board() # pylint: disable=no-value-for-parameter
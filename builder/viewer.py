@@ -15,16 +15,17 @@
 
 
 import datetime
-import json
 import numpy as np
 from sys import argv
 
+from builder import boardformat
+
 filename = argv[1]
 
 filename_base = filename.split('.')[0]
 
-with open(filename, 'r') as f:
-    board = json.load(f)
+with open(filename, 'rb') as f:
+    board = boardformat.read_any(f.read())
     trueboard = np.array(board['tokens'])
     edges = board['edges']
 
@@ -26,6 +26,9 @@ setup(
         'scipy',
         'sqlalchemy',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     entry_points='''
         [console_scripts]
         vorobuilder=builder.builder:build_board
@@ -0,0 +1,75 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from helpers import random_board_data
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # An app on a fresh database in tmp_path, with fresh process-wide
+    # caches, live games and write-behind queue.
+    from web import boards, bot, database, live, shards, users
+    monkeypatch.setattr(boards, 'cache', boards.BoardCache())
+    monkeypatch.setattr(users, 'cache', users.UserCache())
+    writer = live.WriteBehind()
+    monkeypatch.setattr(live, 'writer', writer)
+    monkeypatch.setattr(live, 'games', live.LiveGames(writer))
+    monkeypatch.setattr(shards, 'shard', shards.Shard())
+    monkeypatch.setattr(bot, 'seat', bot.Seat())
+    settings = tmp_path / 'settings.py'
+    settings.write_text('\n'.join([
+        'from web.login_null import blueprint as LOGIN_SYSTEM',
+        'SECRET_KEY = "test"',
+        'ALCHEMY_DATABASE = %r' % ('sqlite:///%s' % (tmp_path / 'voro.db')),
+        'MOVE_JOURNAL = %r' % str(tmp_path / 'moves.journal'),
+        'BOARD_SVG_DIR = %r' % str(tmp_path / 'svg'),
+    ]))
+    monkeypatch.setenv('VORO_SETTINGS', str(settings))
+    import web
+    app = web.create_app()
+    with app.app_context():
+        database.init(database.get_engine())
+    yield app
+    database.dispose_engines()
+
+@pytest.fixture
+def players(app):
+    # Two users and a board, as (user_id, user_id, board_id).
+    from web import models
+    from web.database import db_session
+    with app.app_context():
+        red = models.User(username='red', display_name='Red')
+        blue = models.User(username='blue', display_name='Blue')
+        board = models.Board(board_name='test', board_data=random_board_data(),
+                             num_cells=40)
+        db_session.add_all([red, blue, board])
+        db_session.commit()
+        return red.user_id, blue.user_id, board.board_id
+
+@pytest.fixture
+def new_game(app, players):
+    # Creates a game between the two players; returns its game_id.
+    from web import models
+    from web.database import db_session
+
+    def create():
+        with app.app_context():
+            game = models.Game(game_name='test', board_id=players[2], move_count=0,
+                               player1_id=players[0], player2_id=players[1])
+            game.set_status({'to_move': 1, 'moves_left': 1})
+            db_session.add(game)
+            db_session.commit()
+            return game.game_id
+    return create
@@ -0,0 +1,36 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from scipy.spatial import Delaunay
+
+from builder import boardformat
+
+def random_points(num_cells, num_border, rng):
+    # A ring of border cells around random interior ones, the border first
+    # as the builder orders them.
+    angles = np.linspace(0, 2 * np.pi, num_border, endpoint=False)
+    border = np.stack([np.cos(angles), np.sin(angles)], axis=1) * 10 + 11
+    interior = rng.uniform(3, 19, [num_cells - num_border, 2])
+    return np.concatenate([border, interior])
+
+def delaunay_edges(points):
+    ptr, indices = Delaunay(points).vertex_neighbor_vertices
+    return np.array([(i, j) for i in range(len(points))
+                     for j in indices[ptr[i]:ptr[i+1]]
+                     if i < j], dtype=np.intp)
+
+def random_board_data(num_cells=40, num_border=12, seed=0):
+    points = random_points(num_cells, num_border, np.random.default_rng(seed))
+    return boardformat.encode(points, delaunay_edges(points), num_border)
@@ -0,0 +1,101 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The rules as first written in web/voro.py, on a list of tokens instead of
+# a game model, kept to check web.rules against.
+
+class UnionFind:
+    def __init__(self, length):
+        self.length = length
+        self.parents = [None for i in range(length)]
+        self.block_weights = [1 for i in range(length)]
+        self.custom_weights = [0 for i in range(length)]
+
+    def merge(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i==j:
+            return
+        if self.block_weights[i] < self.block_weights[j]:
+            i, j = j, i
+        self.parents[j] = i
+        self.block_weights[i] += self.block_weights[j]
+        self.custom_weights[i] += self.custom_weights[j]
+
+    def find(self, i):
+        j = i
+        while self.parents[j] is not None:
+            j = self.parents[j]
+        while i != j:
+            k = self.parents[i]
+            self.parents[i] = j
+            i = k
+        return j
+
+    def positive_weight_groups(self):
+        return [(i, self.custom_weights[i])
+                for i in range(self.length)
+                if self.parents[i] is None
+                and self.custom_weights[i] > 0]
+
+def check_game(num_cells, edges, num_border, tokens, game_status):
+    # tokens holds (location, player) pairs.
+    cells = [None for i in range(num_cells)]
+    for location, player in tokens:
+        cells[location] = player
+
+    for i in range(num_border):
+        if cells[i] is None:
+            game_status['border_full'] = False
+            return
+    game_status['border_full'] = True
+    uf = UnionFind(num_cells)
+    for i in range(num_border):
+        uf.custom_weights[i]=1
+    for (i,j) in edges:
+        if i>=num_border or j>=num_border:
+            continue
+        if cells[i] != cells[j]:
+            continue
+        uf.merge(i,j)
+    num_outer_groups = len(uf.positive_weight_groups()) / 2
+    for (i,j) in edges:
+        if cells[i] != cells[j] or cells[i] is None:
+            continue
+        uf.merge(i,j)
+    remaining_connections = len(uf.positive_weight_groups()) - num_outer_groups - 1
+    game_status['connections_remaining'] = remaining_connections
+    if remaining_connections > 0:
+        return
+    game_status['game_complete'] = True
+    scores = [0, 0]
+    for cell, weight in uf.positive_weight_groups():
+        player = 0 if cells[cell] == 1 else 1
+        if weight > 1:
+            scores[player] += weight
+            scores[1 - player] += 4
+        else:
+            scores[1 - player] += 1
+    game_status['score_1'], game_status['score_2'] = scores
+
+def play_token(num_cells, edges, num_border, tokens, game_status, location, color):
+    # The status after a move, as play_token stored it.
+    game_status = dict(game_status)
+    game_status['moves_left'] -= 1
+    if game_status['moves_left'] == 0:
+        game_status['to_move'] = 2 if game_status['to_move'] == 1 else 1
+        game_status['moves_left'] = 2
+    tokens.append((location, color))
+    check_game(num_cells, edges, num_border, tokens, game_status)
+    return game_status
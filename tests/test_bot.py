@@ -0,0 +1,37 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from web import bot, rules
+
+def test_best_move_breaks_ties_by_win_rate():
+    assert bot.best_move({3: 64, 5: 64, 7: 64}, {3: 10.0, 5: 50.0, 7: 30.0}) == 5
+    # A move visited far less often is not trusted, however well it did.
+    assert bot.best_move({3: 640, 5: 64}, {3: 400.0, 5: 64.0}) == 3
+
+@pytest.mark.parametrize('to_move', [1, 2])
+def test_bot_takes_deciding_border_cell(to_move):
+    # A ring of seven border cells, red on 0-2 and blue on 4-6, and sixty
+    # interior cells touching nothing.  Whoever takes cell 3 joins it to
+    # their group and wins 8 to 7, so it is the winning move for either
+    # player, and for the other the move that blocks it.
+    ring = [(i, (i + 1) % 7) for i in range(7)]
+    board = rules.make_board(67, ring, 7)
+    occupancy = np.zeros(67, dtype=np.int8)
+    occupancy[:7] = [1, 1, 1, 0, 2, 2, 2]
+    location, played = bot.choose_move(board, occupancy, to_move, 1, 0.5)
+    assert location == 3
+    assert played > 0
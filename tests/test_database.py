@@ -0,0 +1,73 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from alembic import command
+from alembic.config import Config
+import sqlalchemy as sa
+
+from helpers import random_board_data
+from web import bench
+from web.database import db_session
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        connection = db_session.connection()
+        for name, query in bench.hot_queries():
+            plan, full_scan = bench.query_plan(connection, query)
+            assert not full_scan, (name, plan)
+
+def alembic_config(url):
+    config = Config(os.path.join(ROOT, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(ROOT, 'alembic'))
+    config.set_main_option('sqlalchemy.url', url)
+    return config
+
+def test_index_migration_renumbers_moves_and_usernames(app, tmp_path):
+    # Duplicate tokens and usernames, as the racy checks used to leave them,
+    # in a database from before the unique indexes.
+    url = app.config['ALCHEMY_DATABASE']
+    config = alembic_config(url)
+    command.stamp(config, 'head')
+    command.downgrade(config, '8d21c4e5f6a7')
+    engine = sa.create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(sa.text(
+            "INSERT INTO users (user_id, username, display_name) VALUES "
+            "(1, 'a', 'a'), (2, 'b', 'b'), (3, 'a', 'a'), (4, 'a-3', 'a')"))
+        connection.execute(sa.text(
+            "INSERT INTO boards (board_id, board_name, board_data) VALUES (1, 'b', :data)"),
+            {'data': random_board_data()})
+        connection.execute(sa.text(
+            "INSERT INTO games (game_id, board_id, player1_id, player2_id, move_count, "
+            "game_status_json) VALUES (1, 1, 1, 2, 4, :status)"),
+            {'status': '{"to_move": 1, "moves_left": 2}'})
+        connection.execute(sa.text(
+            "INSERT INTO tokens (token_id, game_id, player, location, move_number) VALUES "
+            "(1, 1, 1, 5, 1), (2, 1, 2, 6, 2), (3, 1, 2, 5, 3), (4, 1, 2, 7, 4)"))
+    command.upgrade(config, 'head')
+    with engine.connect() as connection:
+        tokens = connection.execute(sa.text(
+            'SELECT token_id, move_number FROM tokens ORDER BY token_id')).fetchall()
+        move_count = connection.execute(sa.text(
+            'SELECT move_count FROM games WHERE game_id = 1')).scalar()
+        usernames = connection.execute(sa.text(
+            'SELECT username FROM users ORDER BY user_id')).scalars().all()
+    engine.dispose()
+    assert [tuple(token) for token in tokens] == [(1, 1), (2, 2), (4, 3)]
+    assert move_count == 3
+    assert usernames == ['a', 'b', 'a-3-2', 'a-3']
@@ -0,0 +1,52 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+
+from web import live, models, rules
+from web.database import db_session
+
+def test_concurrent_flushes_store_every_move(app, players, new_game):
+    # Threads queue moves for their own games and flush, as the write-behind
+    # thread, the loop and pool threads do under runasync.
+    game_ids = [new_game() for unused_i in range(4)]
+    writer = live.writer
+    writer.batch_size = 3
+    writer._flusher = object()  # as if started: submit() only flushes full batches
+    errors = []
+
+    def play(game_id):
+        try:
+            with app.app_context():
+                game = live.games.get(game_id)
+                for location, color in enumerate(rules.move_colors(1, 1, 20).tolist()):
+                    writer.submit(game.play(players[color - 1], location, color))
+                    if location % 5 == 0:
+                        writer.flush()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=play, args=(game_id,)) for game_id in game_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        writer.flush()
+        counts = [db_session.query(models.Token).filter_by(game_id=game_id).count()
+                  for game_id in game_ids]
+    assert errors == []
+    assert counts == [20] * len(game_ids)
+    assert os.path.getsize(writer.journal_path) == 0
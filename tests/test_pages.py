@@ -0,0 +1,127 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy as np
+import pytest
+
+from builder import boardformat
+from helpers import random_board_data
+
+@pytest.fixture
+def client(app):
+    app.config['QUERY_COUNT_HEADER'] = True
+    return app.test_client()
+
+def get_page(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return response
+
+def query_count(response):
+    return int(response.headers['X-Query-Count'])
+
+def test_game_page_queries(app, client, players, new_game):
+    # A fixed number of statements however many moves the game has: the
+    # game row, its tokens and its board when cold, and the game row when
+    # the game and board are cached.
+    from web import boards, live, rules, voro
+    game_id = new_game()
+    with app.app_context():
+        for location, color in enumerate(rules.move_colors(1, 1, 10).tolist()):
+            voro.play_token(players[color - 1], game_id, location, color)
+        assert live.games.get(game_id).move_count == 10
+    live.games.clear()
+    boards.cache.clear()
+    client.post('/login', data={'username': 'red'})
+    cells = '"%s"' % ('1221122112' + '0' * 30)
+    for expected in [3, 1]:
+        response = get_page(client, '/games/%d' % game_id)
+        page = response.get_data(as_text=True)
+        assert 'Logged in as Red' in page
+        assert 'set_version(10)' in page and cells in page
+        assert query_count(response) == expected
+
+@pytest.mark.parametrize('path', ['/boards/%d.svg', '/boards/%d/geometry'])
+def test_board_drawings_revalidate(app, client, players, path):
+    # Without their hash in the URL, caches must check back, so that an
+    # edited board is not served stale.
+    from web import models
+    from web.database import db_session
+    path = path % players[2]
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.cache_control.no_cache
+    assert client.get(path, headers={'If-None-Match': response.get_etag()[0]}).status_code == 304
+    versioned = client.get(path + '?v=' + response.get_etag()[0])
+    assert versioned.cache_control.max_age == app.config['BOARD_MAX_AGE']
+    assert versioned.cache_control.immutable
+    with app.app_context():
+        board = db_session.query(models.Board).get(players[2])
+        board.board_data = random_board_data(seed=1)
+        db_session.commit()
+    edited = client.get(path, headers={'If-None-Match': response.get_etag()[0]})
+    assert edited.status_code == 200
+    assert edited.get_etag() != response.get_etag()
+    # The old version's URL now revalidates too.
+    stale = client.get(path + '?v=' + response.get_etag()[0])
+    assert stale.cache_control.no_cache
+    assert stale.get_etag() == edited.get_etag()
+
+def test_pages_link_geometry_by_hash(app, client, players):
+    from web import models
+    from web.database import db_session
+    geometry = client.get('/boards/%d/geometry' % players[2])
+    url = '/boards/%d/geometry?v=%s' % (players[2], geometry.get_etag()[0])
+    assert url in get_page(client, '/boards/%d' % players[2]).get_data(as_text=True)
+    with app.app_context():
+        board = db_session.query(models.Board).get(players[2])
+        board.board_data = random_board_data(seed=1)
+        db_session.commit()
+    assert url not in get_page(client, '/boards/%d' % players[2]).get_data(as_text=True)
+
+def test_replay_reads_moves_not_yet_stored(app, client, players, new_game):
+    # Reading a game must not flush the write-behind queue, but still sees
+    # the moves waiting in it.
+    from web import live, rules, voro
+    game_id = new_game()
+    colors = rules.move_colors(1, 1, 10).tolist()
+    with app.app_context():
+        for location, color in enumerate(colors[:6]):
+            voro.play_token(players[color - 1], game_id, location, color)
+        live.writer._flusher = object()  # as if started: moves stay queued
+        for location, color in enumerate(colors[6:], 6):
+            voro.play_token(players[color - 1], game_id, location, color)
+        cells = live.games.get(game_id).cells()
+    lines = client.get('/games/%d/moves' % game_id).get_data(as_text=True).splitlines()
+    header, moves = json.loads(lines[0]), [json.loads(line) for line in lines[1:]]
+    assert header['move_count'] == 10
+    assert [move[:3] for move in moves] == [
+        [number, location, color]
+        for number, (location, color) in enumerate(enumerate(colors), 1)]
+    latest = client.get('/games/%d/replay' % game_id).get_json()
+    assert (latest['move_count'], latest['cells']) == (10, cells)
+    earlier = client.get('/games/%d/replay?move=8' % game_id).get_json()
+    assert earlier['cells'] == cells[:8] + '0' * (len(cells) - 8)
+    assert len(live.writer.queued(game_id)) == 4
+
+def test_geometry_leaves_out_adjacency(app, client, players):
+    # Browsers only draw the board, from its coordinates and edges.
+    data = client.get('/boards/%d/geometry' % players[2]).get_data()
+    stored = boardformat.decode(random_board_data())
+    geometry = boardformat.decode(data)
+    assert len(data) == 24 + stored['coords'].nbytes + stored['edges'].nbytes
+    for name in ['coords', 'edges', 'indptr', 'indices']:
+        assert np.array_equal(geometry[name], stored[name])
@@ -0,0 +1,49 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from web import rooms
+
+def delta(version, moves):
+    return {'action': 'GAME_DELTA', 'version': version, 'moves': moves,
+            'status': {'version': version}}
+
+class Socket:
+    def send(self, data):
+        pass
+
+def queued_frames(*messages):
+    sender = rooms.SocketSender(Socket())
+    sender._wake = lambda: None  # not started: frames stay queued
+    for message in messages:
+        sender.send(json.dumps(message), message)
+    return [json.loads(data) for data, unused_message, unused_queued in sender._queue]
+
+def test_overlapping_deltas_merge_without_repeats():
+    # A resume reply for moves 2-4 and a broadcast of move 4.
+    frames = queued_frames(delta(4, [[1, 1], [2, 2], [3, 2]]), delta(4, [[3, 2]]))
+    assert frames == [delta(4, [[1, 1], [2, 2], [3, 2]])]
+    frames = queued_frames(delta(4, [[1, 1], [2, 2], [3, 2]]), delta(5, [[3, 2], [4, 1]]))
+    assert frames == [delta(5, [[1, 1], [2, 2], [3, 2], [4, 1]])]
+
+def test_consecutive_deltas_merge():
+    frames = queued_frames(delta(1, [[0, 1]]), delta(2, [[1, 2]]), delta(3, [[2, 2]]))
+    assert frames == [delta(3, [[0, 1], [1, 2], [2, 2]])]
+
+def test_deltas_with_a_gap_or_going_back_stay_apart():
+    gap = [delta(1, [[0, 1]]), delta(3, [[2, 2]])]
+    assert queued_frames(*gap) == gap
+    back = [delta(3, [[1, 2], [2, 2]]), delta(2, [[1, 2]])]
+    assert queued_frames(*back) == back
@@ -0,0 +1,84 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Random legal games, checked move by move against the rules as first
+# written, kept in reference.py.
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from helpers import delaunay_edges, random_points
+import reference
+from web import rules
+
+BOARD_SIZES = [(10, 6), (40, 12), (120, 24)]
+
+def random_board(num_cells, num_border, seed):
+    points = random_points(num_cells, num_border, np.random.default_rng(seed))
+    edges = delaunay_edges(points)
+    return rules.make_board(num_cells, edges, num_border), edges.tolist()
+
+@pytest.mark.parametrize('num_cells,num_border', BOARD_SIZES)
+@pytest.mark.parametrize('seed', range(5))
+def test_random_games_match_reference(num_cells, num_border, seed):
+    board, edges = random_board(num_cells, num_border, seed)
+    rng = np.random.default_rng(seed)
+    position = rules.Position(board)
+    tokens = []
+    expected = {'to_move': 1, 'moves_left': 1}
+    assert rules.status(position) == expected
+    while True:
+        moves = rules.legal_moves(position)
+        if not len(moves):
+            break
+        location = int(rng.choice(moves))
+        color = position.to_move
+        assert rules.apply_move(position, location, color)
+        expected = reference.play_token(num_cells, edges, num_border, tokens,
+                                        expected, location, color)
+        assert rules.status(position) == expected, tokens
+        computed = rules.score(board, position.occupancy)
+        assert computed == {key: expected[key] for key in rules.SCORE_KEYS
+                            if key in expected}, tokens
+    # The game ends when it is complete, or when the board is full.
+    assert expected.get('game_complete') or position.occupancy.all()
+
+@pytest.mark.parametrize('num_cells,num_border', BOARD_SIZES)
+def test_score_many_matches_reference(num_cells, num_border):
+    board, edges = random_board(num_cells, num_border, 0)
+    rng = np.random.default_rng(1)
+    occupancies = rng.integers(1, 3, size=(50, num_cells)).astype(np.int8)
+    scores = rules.score_many(board, occupancies)
+    completed = 0
+    for occupancy, (score_1, score_2) in zip(occupancies, scores.tolist()):
+        expected = {}
+        reference.check_game(num_cells, edges, num_border,
+                             list(enumerate(occupancy.tolist())), expected)
+        # A full board can still have connections remaining, and then has
+        # no score to compare.
+        if expected.get('game_complete'):
+            assert (score_1, score_2) == (expected['score_1'], expected['score_2'])
+            completed += 1
+    assert completed
+
+def test_rules_import_without_flask():
+    # The rules are usable without the app, for simulations and tools.
+    code = ('import sys, web.rules; '
+            'print(sorted(name for name in ("flask", "sqlalchemy") if name in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == '[]'
@@ -0,0 +1,127 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Two workers in one process, connected by a LocalHub.  Each worker has its
+# own shard, socket registry and live games, swapped in for the module-wide
+# ones while it runs, as if it were its own process.
+
+import contextlib
+
+import pytest
+
+from web import live, rooms, shards
+
+class Sender:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, data, message=None):
+        self.messages.append(message)
+        return True
+
+class Worker:
+    def __init__(self, app, hub, index, workers):
+        self.shard = shards.Shard()
+        self.registry = rooms.RoomRegistry()
+        self.games = live.LiveGames(live.writer)
+        endpoint = hub.endpoint(shards.worker_name(index))
+        listen = endpoint.listen
+        endpoint.listen = lambda handler: listen(self.wrap(handler))
+        self.shard.configure(app, index, workers, endpoint)
+
+    @contextlib.contextmanager
+    def active(self):
+        saved = shards.shard, rooms.registry, live.games
+        shards.shard, rooms.registry, live.games = self.shard, self.registry, self.games
+        try:
+            yield
+        finally:
+            shards.shard, rooms.registry, live.games = saved
+
+    def wrap(self, handler):
+        def handle(message):
+            with self.active():
+                handler(message)
+        return handle
+
+    def watch(self, game_id):
+        sender = Sender()
+        self.registry.join(game_id, sender)
+        return sender
+
+@pytest.fixture
+def workers(app):
+    hub = shards.LocalHub()
+    return [Worker(app, hub, index, 2) for index in range(2)]
+
+@pytest.fixture
+def game_id(new_game):
+    # A game owned by worker 0.
+    while True:
+        game_id = new_game()
+        if shards.owner(game_id, 2) == 0:
+            return game_id
+
+def test_play_from_other_worker_is_applied_by_owner(app, players, workers, game_id):
+    owner, other = workers
+    owner_spectator = owner.watch(game_id)
+    other_spectator = other.watch(game_id)
+    with app.app_context(), other.active():
+        other.shard.play(players[0], game_id, 3, 1)
+    assert other.games._games == {}
+    assert owner.games._games[game_id].moves == [(3, 1)]
+    expected = {'action': 'GAME_DELTA', 'version': 1, 'moves': [[3, 1]],
+                'status': {'to_move': 2, 'moves_left': 2, 'border_full': False}}
+    assert owner_spectator.messages == [expected]
+    assert other_spectator.messages == [expected]
+
+def test_illegal_move_from_other_worker_is_not_broadcast(app, players, workers, game_id):
+    owner, other = workers
+    other_spectator = other.watch(game_id)
+    with app.app_context(), other.active():
+        # Blue may not move first.
+        other.shard.play(players[1], game_id, 3, 2)
+    assert other_spectator.messages == []
+
+def test_resume_from_other_worker_is_answered_by_owner(app, players, workers, game_id):
+    owner, other = workers
+    with app.app_context():
+        with owner.active():
+            owner.shard.play(players[0], game_id, 3, 1)
+            owner.shard.play(players[1], game_id, 4, 2)
+        sender = Sender()
+        with other.active():
+            other.shard.resume(game_id, 1, sender)
+            other.shard.resume(game_id, 5, sender)
+    delta, snapshot = sender.messages
+    assert delta['action'] == 'GAME_DELTA'
+    assert (delta['version'], delta['moves']) == (2, [[4, 2]])
+    assert snapshot['action'] == 'GAME_SNAPSHOT'
+    assert snapshot['version'] == 2
+    assert other.shard._pending == {}
+
+def test_resume_unknown_game_or_negative_version(app, players, workers, game_id):
+    owner, other = workers
+    with app.app_context():
+        with owner.active():
+            owner.shard.play(players[0], game_id, 3, 1)
+        sender = Sender()
+        with other.active():
+            other.shard.resume(game_id, -1, sender)
+            # Unknown games are answered by the worker that would own them.
+            other.shard.resume(game_id + 2, 0, sender)
+    snapshot, error = sender.messages
+    assert (snapshot['action'], snapshot['version']) == ('GAME_SNAPSHOT', 1)
+    assert error['action'] == 'ERROR'
+    assert other.shard._pending == {}
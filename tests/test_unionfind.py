@@ -0,0 +1,54 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from helpers import delaunay_edges, random_points
+from web.unionfind import ArrayUnionFind, UnionFind
+
+def groups(uf, length):
+    # The groups as sets of members, with their weights.
+    members = {}
+    for i in range(length):
+        members.setdefault(uf.find(i), set()).add(i)
+    return sorted((sorted(cells), uf.custom_weights[root])
+                  for root, cells in members.items())
+
+@pytest.mark.parametrize('num_cells', [361, 3000])
+def test_array_union_find_matches_lists(num_cells):
+    # 3000 cells have enough edges for merge_many to label them in bulk.
+    rng = np.random.default_rng(0)
+    num_border = 40
+    edges = delaunay_edges(random_points(num_cells, num_border, rng))
+    colors = rng.integers(1, 3, num_cells)
+    same = edges[colors[edges[:, 0]] == colors[edges[:, 1]]]
+    # Some merges one at a time first, so that merge_many starts from a
+    # forest with uncompressed paths.
+    first, rest = same[:len(same) // 3], same[len(same) // 3:]
+    expected = UnionFind(num_cells)
+    bulk = ArrayUnionFind(num_cells)
+    for i in range(num_border):
+        expected.custom_weights[i] = 1
+    bulk.custom_weight_array[:num_border] = 1
+    for (i, j) in first.tolist():
+        expected.merge(i, j)
+        bulk.merge(i, j)
+    for (i, j) in rest.tolist():
+        expected.merge(i, j)
+    bulk.merge_many(rest)
+    assert groups(bulk, num_cells) == groups(expected, num_cells)
+    assert (sorted(weight for unused_root, weight in bulk.positive_weight_groups())
+            == sorted(weight for unused_root, weight in expected.positive_weight_groups()))
+    assert bulk.num_positive_weight_groups() == len(expected.positive_weight_groups())
@@ -12,15 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from flask import Flask, g
-from flask_sockets import Sockets
-import click
-
-from web import database
-from web.voro import app as blueprint
-from web.voro import sockets as voro_sockets
+# The app's modules are imported in create_app, so that modules meant to
+# work on their own, such as web.rules, don't load Flask and SQLAlchemy.
 
 def create_app():
+    from flask import Flask, g
+    from flask_sockets import Sockets
+    import click
+    import glob
+
+    from web import bench, boards, bot, database, live, rescore, shards, users
+    from web.voro import app as blueprint
+    from web.voro import sockets as voro_sockets
+
     app = Flask(__name__)
 
     app.config.from_object('web.default_settings')
@@ -30,6 +34,8 @@ def create_app():
         app.logger.warning('Error in custom configuration: %s', e) 
 
     app.register_blueprint(blueprint, cli_group=None)
+    app.register_blueprint(bench.blueprint)
+    app.register_blueprint(rescore.blueprint)
 
     if 'LOGIN_SYSTEM' not in app.config:
         # TODO: decide on whether to do a default login system
@@ -39,14 +45,58 @@ def create_app():
 
     app.logger.setLevel('INFO')
 
+    app.teardown_appcontext(database.teardown)
+
+    @app.before_request
+    def reset_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def add_query_count(response):
+        if app.config['QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(database.query_count())
+        return response
+
+    boards.cache.maxsize = app.config['BOARD_CACHE_SIZE']
+    boards.cache.svg_dir = app.config['BOARD_SVG_DIR']
+    users.cache.maxsize = app.config['USER_CACHE_SIZE']
+    users.cache.ttl = app.config['USER_CACHE_TTL']
+    live.configure(app)
+
     @app.cli.command('runws')
     @click.option('--port', default=5000, help='Port to run websocket/HTTP server on.')
-    def run_ws(port):
+    @click.option('--workers', default=1,
+                  help='Worker processes to shard games across.')
+    def run_ws(port, workers):
         from gevent import pywsgi
         from geventwebsocket.handler import WebSocketHandler
         current_sockets = Sockets(app)
         current_sockets.register_blueprint(voro_sockets)
+        journal = app.config['MOVE_JOURNAL']
+        replayed = sum(live.writer.replay_journal(path)
+                       for path in [journal] + glob.glob(journal + '.*'))
+        app.logger.info('Replayed %d journalled moves.', replayed)
+        if workers > 1:
+            def serve_listener(listener):
+                bot.seat.start(app)
+                pywsgi.WSGIServer(listener, app,
+                                  handler_class=WebSocketHandler).serve_forever()
+            shards.serve(app, port, workers, serve_listener)
+            return
+        live.writer.start(app)
+        bot.seat.start(app)
         server = pywsgi.WSGIServer(('', port), app, handler_class=WebSocketHandler)
         server.serve_forever()
 
+    @app.cli.command('runasync')
+    @click.option('--port', default=5000, help='Port to run websocket/HTTP server on.')
+    @click.option('--threads', default=8, help='Threads serving HTTP requests through Flask.')
+    def run_async(port, threads):
+        # Needs aiohttp (pip install voronoi[async]).
+        from web import asyncserver
+        replayed = live.writer.replay_journal()
+        app.logger.info('Replayed %d journalled moves.', replayed)
+        live.writer.start(app, threaded=True)
+        asyncserver.run(app, port, threads)
+
     return app
\ No newline at end of file
@@ -0,0 +1,173 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The runasync server: an asyncio loop where aiohttp handles game sockets
+# natively, without holding a Flask context open per socket, while every
+# other request is passed to the Flask app on a thread pool.  Socket
+# messages are handled on the pool too, since a move may load a game,
+# write to the journal or flush to the database; the messages for one game
+# are handled one at a time, in order.  The loop itself only moves bytes.
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import weakref
+
+from aiohttp import web, WSMsgType
+from multidict import CIMultiDict
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from web import live, rooms, users, voro
+
+logger = logging.getLogger(__name__)
+
+# Computed by aiohttp from the body.
+SKIPPED_HEADERS = {'content-length', 'transfer-encoding'}
+
+# Streamed bodies are read from the app in chunks of about this size.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def wsgi_environ(request, body=b''):
+    builder = EnvironBuilder(
+        path=request.path,
+        base_url='%s://%s' % (request.scheme, request.host),
+        query_string=request.query_string,
+        method=request.method,
+        headers=list(request.headers.items()),
+        data=body,
+        environ_overrides={'REMOTE_ADDR': request.remote or ''})
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+class AsyncServer:
+    def __init__(self, app, threads=8):
+        self.app = app
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='flask')
+        # A lock per game with sockets open, held while handling a message.
+        self._game_locks = weakref.WeakValueDictionary()
+
+    def make_app(self):
+        server = web.Application()
+        server.router.add_get(r'/games/{id:\d+}', self.handle_game)
+        server.router.add_route('*', '/{tail:.*}', self.handle_http)
+        return server
+
+    async def run_in_pool(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args)
+
+    def call_app(self, environ, start_stream):
+        # Runs a request, returning its status, headers and body.  A body
+        # the app streams, sending no Content-Length, is instead passed a
+        # chunk at a time to the writer start_stream(status, headers)
+        # returns, from this same thread, which the app's context belongs to.
+        app_iter, status, headers = run_wsgi_app(self.app, environ)
+        try:
+            status_code = int(status.split(None, 1)[0])
+            if 'Content-Length' in headers or status_code in (204, 304):
+                return status_code, headers, b''.join(app_iter)
+            write = start_stream(status_code, headers)
+            chunks = iter(app_iter)
+            while True:
+                chunk = read_chunk(chunks)
+                if not chunk:
+                    return None
+                write(chunk)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    async def handle_http(self, request):
+        environ = wsgi_environ(request, await request.read())
+        loop = asyncio.get_running_loop()
+        stream = None
+
+        def on_loop(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        def start_stream(status, headers):
+            # Writes wait for the client, which holds back a slow reader.
+            nonlocal stream
+            stream = web.StreamResponse(status=status, headers=response_headers(headers))
+            on_loop(stream.prepare(request))
+            return lambda chunk: on_loop(stream.write(chunk))
+
+        result = await self.run_in_pool(self.call_app, environ, start_stream)
+        if stream is not None:
+            await stream.write_eof()
+            return stream
+        status, headers, body = result
+        return web.Response(status=status, headers=response_headers(headers), body=body)
+
+    async def handle_game(self, request):
+        if request.headers.get('Upgrade', '').lower() != 'websocket':
+            return await self.handle_http(request)
+        game_id = int(request.match_info['id'])
+        user, game = await self.run_in_pool(
+            self.open_game, wsgi_environ(request), game_id)
+        if game is None:
+            raise web.HTTPNotFound()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sender = rooms.AsyncSocketSender(
+            ws,
+            max_queue=self.app.config['SEND_QUEUE_SIZE'],
+            max_lag=self.app.config['SEND_MAX_LAG'])
+        rooms.registry.join(game_id, sender)
+        lock = self._game_locks.setdefault(game_id, asyncio.Lock())
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    async with lock:
+                        await self.run_in_pool(self.handle_message, user, game_id,
+                                               sender, msg.data)
+        finally:
+            rooms.registry.leave(game_id, sender)
+            sender.close()
+        return ws
+
+    def open_game(self, environ, game_id):
+        with self.app.request_context(environ):
+            return users.current_user(), live.games.get(game_id)
+
+    def handle_message(self, user, game_id, sender, raw_message):
+        try:
+            with self.app.app_context():
+                voro.handle_message(user, game_id, sender, json.loads(raw_message))
+        except Exception:
+            logger.exception('Error in websocket; raw message was %r', raw_message)
+
+def response_headers(headers):
+    return CIMultiDict((name, value) for name, value in headers
+                       if name.lower() not in SKIPPED_HEADERS)
+
+def read_chunk(chunks):
+    # Joins the app's next pieces of body, up to about STREAM_CHUNK_SIZE;
+    # empty at the end.
+    parts = []
+    size = 0
+    for part in chunks:
+        parts.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            break
+    return b''.join(parts)
+
+def run(app, port, threads):
+    web.run_app(AsyncServer(app, threads).make_app(), port=port,
+                print=lambda message: app.logger.info(message))
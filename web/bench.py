@@ -0,0 +1,431 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import concurrent.futures
+from flask import Blueprint, current_app
+import click
+import numpy as np
+import os
+import shutil
+from sqlalchemy import or_, text
+from scipy.spatial import Delaunay
+import tempfile
+import time
+import timeit
+
+from builder import builder
+from web import boards, bot, models, rules, users
+from web.database import db_session
+from web.unionfind import ArrayUnionFind, UnionFind
+
+blueprint = Blueprint('bench', __name__, cli_group='bench')
+
+def random_board(num_cells, rng):
+    points = rng.standard_normal([num_cells, 2])
+    ptr, indices = Delaunay(points).vertex_neighbor_vertices
+    edges = np.array([(i, j) for i in range(num_cells)
+                      for j in indices[ptr[i]:ptr[i+1]]
+                      if i < j], dtype=np.intp)
+    return edges
+
+def report(name, seconds, repeat):
+    click.echo('  %-28s %10.1f us/run' % (name, seconds / repeat * 1e6))
+
+def report_cache(name, stats):
+    click.echo('  %-28s %d/%d entries, %d hits, %d misses' % (
+        name, stats['size'], stats['maxsize'], stats['hits'], stats['misses']))
+
+@blueprint.cli.command('unionfind')
+@click.option('--cells', type=int, multiple=True, default=[361, 10000],
+              help='Board sizes to benchmark (may be repeated).')
+@click.option('--repeat', type=int, default=20, help='Runs per measurement.')
+def bench_unionfind(cells, repeat):
+    rng = np.random.default_rng(0)
+    for num_cells in cells:
+        edges = random_board(num_cells, rng)
+        colors = rng.integers(1, 3, num_cells)
+        same = edges[colors[edges[:, 0]] == colors[edges[:, 1]]]
+        num_border = int(np.sqrt(num_cells)) * 3
+        click.echo('%d cells, %d same-color edges:' % (num_cells, len(same)))
+
+        def run_list():
+            uf = UnionFind(num_cells)
+            for i in range(num_border):
+                uf.custom_weights[i] = 1
+            for (i, j) in same.tolist():
+                uf.merge(i, j)
+            return len(uf.positive_weight_groups())
+
+        def run_array():
+            uf = ArrayUnionFind(num_cells)
+            uf.custom_weight_array[:num_border] = 1
+            for (i, j) in same.tolist():
+                uf.merge(i, j)
+            return uf.num_positive_weight_groups()
+
+        def run_bulk():
+            uf = ArrayUnionFind(num_cells)
+            uf.custom_weight_array[:num_border] = 1
+            uf.merge_many(same)
+            return uf.num_positive_weight_groups()
+
+        report('UnionFind.merge', timeit.timeit(run_list, number=repeat), repeat)
+        report('ArrayUnionFind.merge', timeit.timeit(run_array, number=repeat), repeat)
+        report('ArrayUnionFind.merge_many', timeit.timeit(run_bulk, number=repeat), repeat)
+
+def random_game(board, rng):
+    # Plays random legal moves until the game is over or the board is full.
+    position = rules.Position(board)
+    for location in rng.permutation(board.num_cells).tolist():
+        if not rules.apply_move(position, location, position.to_move):
+            break
+        yield position
+
+@blueprint.cli.command('rules')
+@click.option('--cells', type=int, multiple=True, default=[361, 10000],
+              help='Board sizes to benchmark (may be repeated).')
+@click.option('--games', type=int, default=20, help='Random games per board size.')
+@click.option('--check', type=int, default=5,
+              help='Games per board size to check against rules.score after every move.')
+def bench_rules(cells, games, check):
+    rng = np.random.default_rng(0)
+    mismatches = 0
+    for num_cells in cells:
+        num_border = int(np.sqrt(num_cells)) * 3
+        board = rules.make_board(num_cells, random_board(num_cells, rng), num_border)
+        moves = 0
+        start = timeit.default_timer()
+        for unused_i in range(games):
+            for position in random_game(board, rng):
+                pass
+            moves += position.move_count
+        elapsed = timeit.default_timer() - start
+        click.echo('%d cells: %.0f moves/s over %d games (%.1f moves each)' % (
+            num_cells, moves / elapsed, games, moves / games))
+        # The incremental status must always agree with the from-scratch one.
+        for unused_i in range(check):
+            for position in random_game(board, rng):
+                expected = {'to_move': position.to_move,
+                            'moves_left': position.moves_left}
+                expected.update(rules.score(board, position.occupancy))
+                if rules.status(position) != expected:
+                    mismatches += 1
+                    click.echo('  after move %d: %s != %s' % (
+                        position.move_count, rules.status(position), expected))
+                    break
+    if mismatches:
+        raise click.ClickException('%d games disagree with rules.score' % mismatches)
+
+@blueprint.cli.command('bot')
+@click.option('--cells', type=int, multiple=True, default=[361],
+              help='Board sizes to benchmark (may be repeated).')
+@click.option('--jobs', type=int, multiple=True, default=[1, 2, 4],
+              help='Search processes to benchmark (may be repeated).')
+@click.option('--seconds', type=float, default=2.0, help='Search time per move.')
+@click.option('--batch', type=int, default=64, help='Playouts per tree leaf.')
+def bench_bot(cells, jobs, seconds, batch):
+    # Playout throughput of the computer player, choosing red's first move.
+    rng = np.random.default_rng(0)
+    for num_cells in cells:
+        num_border = int(np.sqrt(num_cells)) * 3
+        board = rules.make_board(num_cells, random_board(num_cells, rng), num_border)
+        occupancy = np.zeros(num_cells, dtype=np.int8)
+        click.echo('%d cells:' % num_cells)
+        for count in jobs:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=count) as pool:
+                # Starts the workers before timing.
+                list(pool.map(abs, range(count)))
+                start = timeit.default_timer()
+                move, played = bot.choose_move(board, occupancy, 1, 1, seconds,
+                                               batch, pool, count)
+                elapsed = timeit.default_timer() - start
+            click.echo('  %2d jobs %10.0f playouts/s (%d playouts, move %d)' % (
+                count, played / elapsed, played, move))
+
+@blueprint.cli.command('lloyd')
+@click.option('--border', type=int, default=51, help='Number of border tokens.')
+@click.option('--interior', type=int, multiple=True, default=[310, 10000],
+              help='Interior token counts to benchmark (may be repeated).')
+@click.option('--repeat', type=int, default=10, help='Iterations per measurement.')
+def bench_lloyd(border, interior, repeat):
+    rng = np.random.default_rng(0)
+    for num_interior in interior:
+        pts = rng.standard_normal([num_interior, 2])
+        for unused_i in range(5):
+            pts = builder.cvcirc(pts, border, 20)[:num_interior]
+        click.echo('%d interior, %d border cells:' % (num_interior, border))
+        report('cvcirc_reference', timeit.timeit(
+            lambda: builder.cvcirc_reference(pts, border, 20), number=repeat), repeat)
+        report('cvcirc', timeit.timeit(
+            lambda: builder.cvcirc(pts, border, 20), number=repeat), repeat)
+
+@blueprint.cli.command('requests')
+@click.option('--path', 'paths', multiple=True,
+              default=['/boards', '/games/1', '/boards/1.svg',
+                       '/boards/1/geometry'],
+              help='Paths to request (may be repeated).')
+@click.option('--count', type=int, default=200, help='Requests per path.')
+@click.option('--max-queries', type=int, default=None,
+              help='Fail if a warm request runs more SQL statements than this.')
+def bench_requests(paths, count, max_queries):
+    current_app.config['QUERY_COUNT_HEADER'] = True
+    client = current_app.test_client()
+    over = []
+    for path in paths:
+        client.get(path)
+        response = client.get(path)
+        queries = int(response.headers['X-Query-Count'])
+        if max_queries is not None and queries > max_queries:
+            over.append(path)
+        start = timeit.default_timer()
+        for unused_i in range(count):
+            client.get(path)
+        elapsed = timeit.default_timer() - start
+        click.echo('  %-28s %10.1f req/s (status %d, %d bytes, %d queries)' % (
+            path, count / elapsed, response.status_code, len(response.data), queries))
+    report_cache('board cache', boards.cache.stats())
+    report_cache('user cache', users.cache.stats())
+    if over:
+        raise click.ClickException('Too many queries: %s' % ', '.join(over))
+
+def hot_queries():
+    yield 'token at location', (db_session.query(models.Token)
+                                .filter_by(game_id=1).filter_by(location=0))
+    yield 'tokens of game', db_session.query(models.Token).filter_by(game_id=1)
+    yield 'games of player', db_session.query(models.Game).filter(
+        or_(models.Game.player1_id == 1, models.Game.player2_id == 1))
+    yield 'games on board', db_session.query(models.Game).filter_by(board_id=1)
+    yield 'user by username', db_session.query(models.User).filter_by(username='a')
+    yield 'active games', (db_session.query(models.Game)
+                           .filter(models.Game.game_complete == False)
+                           .filter(models.Game.game_id > 1)
+                           .order_by(models.Game.game_id))
+    yield 'replay checkpoint', (db_session.query(models.Checkpoint)
+                                .filter_by(game_id=1)
+                                .filter(models.Checkpoint.move_number <= 100)
+                                .order_by(models.Checkpoint.move_number.desc()))
+    yield 'move log', (db_session.query(models.Token).filter_by(game_id=1)
+                       .filter(models.Token.move_number > 96)
+                       .order_by(models.Token.move_number))
+    yield 'boards by size', (db_session.query(models.Board)
+                             .filter(models.Board.num_cells >= 100)
+                             .filter(models.Board.board_id > 1)
+                             .order_by(models.Board.board_id))
+
+def query_plan(connection, query):
+    # SQLite's plan for a query, and whether it scans a whole table.
+    sql = str(query.statement.compile(
+        dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    plan = [row[-1] for row in connection.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+    full_scan = any(step.startswith('SCAN') and 'INDEX' not in step
+                    for step in plan)
+    return plan, full_scan
+
+@blueprint.cli.command('queryplans')
+def bench_queryplans():
+    # Prints SQLite's plan for each hot query, flagging full table scans.
+    connection = db_session.connection()
+    scans = 0
+    for name, query in hot_queries():
+        plan, full_scan = query_plan(connection, query)
+        scans += full_scan
+        click.echo('%-18s %s %s' % (name, 'SCAN ' if full_scan else 'index', '; '.join(plan)))
+    if scans:
+        raise click.ClickException('%d hot queries scan a whole table' % scans)
+
+def process_rss(pid):
+    # Resident memory of a local process in kB, from /proc.
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+FUTURE_VERSION = 1 << 30
+
+async def socket_load(base_url, game_id, spectators, concurrency, username, timeout, pid):
+    import aiohttp
+    ws_url = 'ws' + base_url[len('http'):] + '/games/%d' % game_id
+    results = {}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector,
+                                     cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def spectate():
+            async with limit:
+                ws = await session.ws_connect(ws_url)
+                # A version from the future, so the reply is always a snapshot.
+                await ws.send_json({'action': 'RESUME', 'version': FUTURE_VERSION})
+                await ws.receive()
+                return ws
+
+        start = time.perf_counter()
+        sockets = await asyncio.gather(*[spectate() for unused_i in range(spectators)])
+        results['connect'] = time.perf_counter() - start
+        if pid is not None:
+            results['rss'] = process_rss(pid)
+
+        if username is not None:
+            await session.post(base_url + '/login', data={'username': username})
+            player = await session.ws_connect(ws_url)
+            await player.send_json({'action': 'RESUME', 'version': FUTURE_VERSION})
+            snapshot = (await player.receive()).json()
+            start = time.perf_counter()
+            await player.send_json({
+                'action': 'PLAY_TOKEN',
+                'location': snapshot['cells'].index('0'),
+                'color': snapshot['status']['to_move'],
+            })
+            await asyncio.wait_for(
+                asyncio.gather(*[ws.receive() for ws in sockets]), timeout)
+            results['broadcast'] = time.perf_counter() - start
+            await player.close()
+
+        await asyncio.gather(*[ws.close() for ws in sockets])
+    return results
+
+@blueprint.cli.command('sockets')
+@click.argument('base_url', default='http://localhost:5000')
+@click.option('--game', 'game_id', type=int, default=1, help='Game to watch.')
+@click.option('--spectators', type=int, default=1000, help='Sockets to open.')
+@click.option('--concurrency', type=int, default=200, help='Connections opened at once.')
+@click.option('--username', default=None,
+              help='Player to move as; times a move reaching every spectator.')
+@click.option('--pid', type=int, default=None,
+              help='Server process to report the memory use of.')
+@click.option('--timeout', type=float, default=60.0, help='Seconds to wait for the broadcast.')
+def bench_sockets(base_url, game_id, spectators, concurrency, username, pid, timeout):
+    # Load test for a running server (runws or runasync).  Needs aiohttp,
+    # and a file descriptor limit above the number of spectators.
+    rss_before = process_rss(pid) if pid is not None else None
+    try:
+        results = asyncio.run(socket_load(base_url.rstrip('/'), game_id, spectators,
+                                          concurrency, username, timeout, pid))
+    except asyncio.TimeoutError:
+        raise click.ClickException('The move was not broadcast; is %s the player '
+                                   'to move in game %d?' % (username, game_id))
+    click.echo('%d spectators connected in %.2fs (%.0f/s)' % (
+        spectators, results['connect'], spectators / results['connect']))
+    if 'broadcast' in results:
+        click.echo('move reached all spectators in %.1f ms' % (results['broadcast'] * 1e3))
+    if pid is not None:
+        click.echo('server RSS %d kB idle, %d kB with spectators (%.1f kB each)' % (
+            rss_before, results['rss'], (results['rss'] - rss_before) / spectators))
+
+def scratch_games(count, board_id, user_id):
+    games = [models.Game(game_name='bench shards', board_id=board_id, move_count=0,
+                         player1_id=user_id, player2_id=user_id)
+             for unused_i in range(count)]
+    for game in games:
+        game.set_status({'to_move': 1, 'moves_left': 1})
+    db_session.add_all(games)
+    db_session.commit()
+    return [game.game_id for game in games]
+
+def delete_games(game_ids):
+    db_session.query(models.Checkpoint).filter(
+        models.Checkpoint.game_id.in_(game_ids)).delete(synchronize_session=False)
+    db_session.query(models.Token).filter(
+        models.Token.game_id.in_(game_ids)).delete(synchronize_session=False)
+    db_session.query(models.Game).filter(
+        models.Game.game_id.in_(game_ids)).delete(synchronize_session=False)
+    db_session.commit()
+
+def shard_load(app, workers, game_ids, user_id, moves, timeout):
+    # Forks shard workers, then plays every game from this process over the
+    # bus, as an observer that gets each move's broadcast.  A game's next
+    # move is sent once the last one comes back, so games run concurrently
+    # but each one's moves are serialized, as they are with real players.
+    import gevent
+    from gevent.event import Event
+    from web import database, shards
+    directory = tempfile.mkdtemp(prefix='voro-bus-')
+    journal = app.config['MOVE_JOURNAL']
+    app.config['MOVE_JOURNAL'] = os.path.join(directory, 'journal')
+    database.teardown()
+    database.dispose_engines()
+
+    def run(index):
+        shards.start_worker(app, index, workers, directory, observers=['bench'])
+        Event().wait()
+
+    pids = shards.fork_workers(workers, run)
+    app.config['MOVE_JOURNAL'] = journal
+    endpoint = shards.UnixEndpoint(directory, 'bench')
+    played = dict.fromkeys(game_ids, 0)
+    done = Event()
+
+    def play(game_id, color):
+        endpoint.send(shards.worker_name(shards.owner(game_id, workers)), {
+            'type': 'play',
+            'user_id': user_id,
+            'game_id': game_id,
+            'location': played[game_id],
+            'color': color,
+        })
+
+    def handle(message):
+        game_id = message['game_id']
+        played[game_id] = message['message']['version']
+        if played[game_id] < moves:
+            play(game_id, message['message']['status']['to_move'])
+        elif all(count >= moves for count in played.values()):
+            done.set()
+
+    try:
+        endpoint.listen(handle)
+        while not all(os.path.exists(endpoint.path(shards.worker_name(i)))
+                      for i in range(workers)):
+            gevent.sleep(0.01)
+        start = time.perf_counter()
+        for game_id in game_ids:
+            play(game_id, 1)
+        finished = done.wait(timeout)
+        elapsed = time.perf_counter() - start
+    finally:
+        shards.stop_workers(pids)
+        endpoint.close()
+        shutil.rmtree(directory)
+    if not finished:
+        raise click.ClickException('Only %d of %d moves were played' % (
+            sum(played.values()), moves * len(game_ids)))
+    return elapsed
+
+@blueprint.cli.command('shards')
+@click.option('--workers', type=int, multiple=True, default=[1, 2, 4],
+              help='Worker counts to benchmark (may be repeated).')
+@click.option('--games', type=int, default=64, help='Games played at once.')
+@click.option('--moves', type=int, default=100, help='Moves played in each game.')
+@click.option('--board', 'board_id', type=int, default=1, help='Board to play on.')
+@click.option('--timeout', type=float, default=60.0, help='Seconds to wait for the moves.')
+def bench_shards(workers, games, moves, board_id, timeout):
+    # Moves per second through runws's sharded move path: each move goes
+    # over the bus to its game's owner, is validated, journalled and
+    # queued for the database there, and is broadcast back.  Plays scratch
+    # games, which are deleted afterwards.
+    app = current_app._get_current_object()
+    board = db_session.query(models.Board).filter_by(board_id=board_id).first()
+    user = db_session.query(models.User).first()
+    if board is None or user is None:
+        raise click.ClickException('Needs board %d and at least one user' % board_id)
+    moves = min(moves, board.num_cells)
+    for count in workers:
+        game_ids = scratch_games(games, board_id, user.user_id)
+        try:
+            elapsed = shard_load(app, count, game_ids, user.user_id, moves, timeout)
+        finally:
+            delete_games(game_ids)
+        click.echo('  %2d workers %10.0f moves/s' % (count, games * moves / elapsed))
@@ -0,0 +1,216 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict, namedtuple
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from flask import render_template
+import numpy as np
+from sqlalchemy import event
+
+from builder import boardformat
+from web import models
+from web.database import db_session
+
+logger = logging.getLogger(__name__)
+
+def _frozen(a):
+    a.setflags(write=False)
+    return a
+
+# A board parsed once into read-only arrays, with the CSR adjacency
+# precomputed.
+class CompiledBoard:
+    __slots__ = ('board_id', 'board_name', 'num_cells', 'num_border',
+                 'coords', 'edges', 'indptr', 'indices', 'border_mask',
+                 'radius', 'svg', 'geometry')
+
+    def __init__(self, board_id, board_name, coords, edges, num_border,
+                 indptr=None, indices=None):
+        self.board_id = board_id
+        self.board_name = board_name
+        self.coords = _frozen(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+        self.edges = _frozen(np.asarray(edges, dtype=np.intp).reshape(-1, 2))
+        self.num_cells = len(self.coords)
+        self.num_border = num_border
+        if indptr is None:
+            indptr, indices = boardformat.adjacency(self.num_cells, self.edges)
+        self.indptr = _frozen(np.asarray(indptr))
+        self.indices = _frozen(np.asarray(indices))
+        self.border_mask = _frozen(np.arange(self.num_cells) < self.num_border)
+
+        lengths = np.linalg.norm(self.coords[self.edges[:, 0]]
+                                 - self.coords[self.edges[:, 1]], axis=1)
+        self.radius = float(lengths.min()) * 0.45
+        self.svg = None
+        self.geometry = None
+
+    @classmethod
+    def from_model(cls, board_model):
+        if board_model.board_data is not None:
+            board = boardformat.decode(board_model.board_data)
+            return cls(board_model.board_id, board_model.board_name,
+                       board['coords'], board['edges'], board['num_border'],
+                       board['indptr'], board['indices'])
+        board = json.loads(board_model.board_json)
+        return cls(board_model.board_id, board_model.board_name,
+                   board['tokens'], board['edges'], board['num_border'])
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def layout(self):
+        # The template data for drawing the board, built on demand: only
+        # render_svg needs it, once per board.
+        shifted = (self.coords + 22).tolist()
+        return {
+            'board_id': self.board_id,
+            'board_name': self.board_name,
+            'edges': [{'x1': shifted[i][0], 'y1': shifted[i][1],
+                       'x2': shifted[j][0], 'y2': shifted[j][1]}
+                      for (i, j) in self.edges.tolist()],
+            'cells': [{'num': i, 'x': x, 'y': y} for i, (x, y) in enumerate(shifted)],
+            'radius': self.radius,
+        }
+
+# Process-wide LRU cache of CompiledBoards keyed by board_id.
+class BoardCache:
+    def __init__(self, maxsize=64, svg_dir=None):
+        self.maxsize = maxsize
+        self.svg_dir = svg_dir
+        self.hits = 0
+        self.misses = 0
+        self._boards = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, board_id, loader):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is not None:
+                self._boards.move_to_end(board_id)
+                self.hits += 1
+                return board
+            self.misses += 1
+        board = loader(board_id)
+        if board is None:
+            return None
+        with self._lock:
+            self._boards[board_id] = board
+            self._boards.move_to_end(board_id)
+            while len(self._boards) > self.maxsize:
+                self._boards.popitem(last=False)
+        return board
+
+    def invalidate(self, board_id):
+        with self._lock:
+            self._boards.pop(board_id, None)
+        if self.svg_dir is not None:
+            try:
+                os.remove(self.svg_path(board_id))
+            except FileNotFoundError:
+                pass
+
+    def svg_path(self, board_id):
+        return os.path.join(self.svg_dir, '%d.svg' % board_id)
+
+    def clear(self):
+        with self._lock:
+            self._boards.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._boards),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+cache = BoardCache()
+
+def _load_board(board_id):
+    board_model = db_session.query(models.Board).filter_by(board_id=board_id).first()
+    if board_model is None:
+        return None
+    return CompiledBoard.from_model(board_model)
+
+def get_board(board_id):
+    return cache.get(int(board_id), _load_board)
+
+# A response body that never changes for a board, with a hash of its bytes
+# to use as the ETag.
+Payload = namedtuple('Payload', ['data', 'etag'])
+
+def _payload(data):
+    return Payload(data, hashlib.sha256(data).hexdigest())
+
+# The static board drawing, rendered once per board.  It is kept on the
+# CompiledBoard and, if the cache has an svg_dir, on disk so that restarts
+# don't render it again.
+
+def render_svg(board):
+    return render_template('board.svg', **board.layout()).encode()
+
+def _read_svg(board_id):
+    if cache.svg_dir is None:
+        return None
+    try:
+        with open(cache.svg_path(board_id), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_svg(board_id, data):
+    if cache.svg_dir is None:
+        return
+    try:
+        os.makedirs(cache.svg_dir, exist_ok=True)
+        path = cache.svg_path(board_id)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        logger.warning('Could not save SVG for board %d', board_id, exc_info=True)
+
+def get_svg(board_id):
+    board = get_board(board_id)
+    if board is None:
+        return None
+    if board.svg is None:
+        data = _read_svg(board.board_id)
+        if data is None:
+            data = render_svg(board)
+            _write_svg(board.board_id, data)
+        board.svg = _payload(data)
+    return board.svg
+
+def get_geometry(board_id):
+    # The board in the binary format, which browsers can read straight into
+    # typed arrays to draw the board themselves.  They only need the
+    # coordinates and edges, so the adjacency is left out.
+    board = get_board(board_id)
+    if board is None:
+        return None
+    if board.geometry is None:
+        board.geometry = _payload(boardformat.encode(
+            board.coords, board.edges, board.num_border, with_adjacency=False))
+    return board.geometry
+
+@event.listens_for(models.Board, 'after_update')
+@event.listens_for(models.Board, 'after_delete')
+def _invalidate_board(mapper, connection, target):
+    cache.invalidate(target.board_id)
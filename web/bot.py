@@ -0,0 +1,223 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A computer player: Monte Carlo tree search over the rules module's
+# positions.  Each tree leaf is valued by a batch of random playouts, run
+# together as rows of one occupancy matrix and scored at once by
+# rules.score_many.  A playout fills every empty cell in turn order and
+# scores the full board, which stands in for playing to completion.
+#
+# Every move is tried at the root, but deeper nodes are widened
+# progressively: one gets another child only after its children have been
+# visited enough, so that the search goes deeper on the promising moves
+# instead of trying each reply once.
+#
+# choose_move searches for a fixed time.  With a process pool, every worker
+# grows its own tree and their root statistics are added up.
+
+import concurrent.futures
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from web import rules
+
+logger = logging.getLogger(__name__)
+
+def playouts(board, occupancy, to_move, moves_left, count, rng):
+    # Plays count random games from a position; returns how many red won,
+    # with a tie counting as half.
+    empty = np.flatnonzero(occupancy == 0)
+    boards = np.repeat(occupancy[None, :], count, axis=0)
+    if len(empty):
+        order = np.argsort(rng.random((count, len(empty))), axis=1)
+        boards[np.arange(count)[:, None], empty[order]] = rules.move_colors(
+            to_move, moves_left, len(empty))
+    scores = rules.score_many(board, boards)
+    return (np.count_nonzero(scores[:, 0] > scores[:, 1])
+            + 0.5 * np.count_nonzero(scores[:, 0] == scores[:, 1]))
+
+class Node:
+    # wins are counted for color, the player who made move.
+    __slots__ = ('move', 'color', 'children', 'untried', 'visits', 'wins')
+
+    def __init__(self, move, color, untried):
+        self.move = move
+        self.color = color
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+
+    def widens(self, batch, widening):
+        # Whether to add a child, allowing about widening times the square
+        # root of the number of leaves valued below this node.
+        return len(self.children) < widening * math.sqrt(self.visits / batch) + 1
+
+    def best_child(self, exploration):
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child: (
+            child.wins / child.visits
+            + exploration * math.sqrt(log_visits / child.visits)))
+
+def search(board, occupancy, to_move, moves_left, seconds, batch=64,
+           exploration=1.0, widening=2.0, seed=None):
+    # Grows a tree for the given time; returns the moves tried at the root
+    # with their visits and wins for to_move, and the playouts run.
+    rng = np.random.default_rng(seed)
+    root = Node(None, None, rng.permutation(np.flatnonzero(occupancy == 0)).tolist())
+    deadline = time.perf_counter() + seconds
+    played = 0
+
+    def expands(node):
+        return bool(node.untried) and (node is root or node.widens(batch, widening))
+
+    while root.untried or root.children:
+        cells = occupancy.copy()
+        turn = (to_move, moves_left)
+        node = root
+        path = [root]
+        while node.children and not expands(node):
+            node = node.best_child(exploration)
+            cells[node.move] = node.color
+            turn = rules.next_turn(*turn)
+            path.append(node)
+        if expands(node):
+            move = node.untried.pop()
+            cells[move] = turn[0]
+            child = Node(move, turn[0],
+                         rng.permutation(np.flatnonzero(cells == 0)).tolist())
+            node.children.append(child)
+            turn = rules.next_turn(*turn)
+            path.append(child)
+        red_wins = playouts(board, cells, turn[0], turn[1], batch, rng)
+        for node in path:
+            node.visits += batch
+            node.wins += red_wins if node.color == 1 else batch - red_wins
+        played += batch
+        if time.perf_counter() >= deadline:
+            break
+    return ([child.move for child in root.children],
+            [child.visits for child in root.children],
+            [child.wins for child in root.children],
+            played)
+
+def best_move(visits, wins):
+    # The move with the best win rate among those visited at least half as
+    # often as the most visited one, so that a few lucky playouts do not
+    # decide; visits and wins are dicts by move.
+    most = max(visits.values())
+    return max((move for move in visits if 2 * visits[move] >= most),
+               key=lambda move: (wins[move] / visits[move], visits[move]))
+
+def choose_move(board, occupancy, to_move, moves_left, seconds, batch=64,
+                pool=None, jobs=1):
+    # Returns the best move by best_move(), or None if there is none, and
+    # the number of playouts run.  board must be picklable to use a pool, as
+    # a rules.Board is.
+    seeds = np.random.SeedSequence().spawn(jobs)
+    args = (board, occupancy, to_move, moves_left, seconds, batch)
+    if pool is None:
+        results = [search(*args, seed=seeds[0])]
+    else:
+        futures = [pool.submit(search, *args, seed=seed) for seed in seeds]
+        results = [future.result() for future in futures]
+    visits = {}
+    wins = {}
+    for moves, move_visits, move_wins, unused_played in results:
+        for move, count, won in zip(moves, move_visits, move_wins):
+            visits[move] = visits.get(move, 0) + count
+            wins[move] = wins.get(move, 0.0) + won
+    played = sum(result[3] for result in results)
+    if not visits:
+        return None, played
+    return best_move(visits, wins), played
+
+# The computer's seat in runws: when it is the bot user's turn in a game,
+# a search runs on gevent's thread pool, so the server keeps serving, and
+# the move is then played like any other.  Disabled unless BOT_USERNAME
+# names a user.
+class Seat:
+    def __init__(self):
+        self.user_id = None
+        self.seconds = 2.0
+        self.batch = 64
+        self.jobs = 1
+        self._app = None
+        self._pool = None
+        self._thinking = set()
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        from web import models
+        from web.database import db_session
+        username = app.config['BOT_USERNAME']
+        if username is None:
+            return
+        with app.app_context():
+            user = db_session.query(models.User).filter_by(username=username).first()
+        if user is None:
+            logger.warning('No user %s to play as; the bot is disabled', username)
+            return
+        self.user_id = user.user_id
+        self.seconds = app.config['BOT_MOVE_SECONDS']
+        self.batch = app.config['BOT_BATCH']
+        self.jobs = app.config['BOT_JOBS']
+        self._app = app
+
+    def on_turn(self, game):
+        # Called with a live game whenever it may have become the bot's turn.
+        if self._app is None or game.position.complete:
+            return
+        if game.player_ids[game.position.to_move - 1] != self.user_id:
+            return
+        with self._lock:
+            if game.game_id in self._thinking:
+                return
+            self._thinking.add(game.game_id)
+        import gevent
+        gevent.spawn(self._play, game)
+
+    def _play(self, game):
+        import gevent
+        from web import voro
+        position = game.position
+        board = position.board
+        color = position.to_move
+        try:
+            location, played = gevent.get_hub().threadpool.apply(self._choose, (
+                rules.Board(board.num_cells, board.num_border, board.indptr, board.indices),
+                position.occupancy.copy(), color, position.moves_left))
+            logger.info('Bot move %s in game %d after %d playouts',
+                        location, game.game_id, played)
+        except Exception:
+            logger.exception('Bot search failed in game %d', game.game_id)
+            location = None
+        finally:
+            with self._lock:
+                self._thinking.discard(game.game_id)
+        if location is not None:
+            with self._app.app_context():
+                voro.play_token(self.user_id, game.game_id, location, color)
+
+    def _choose(self, board, occupancy, to_move, moves_left):
+        if self.jobs > 1 and self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs)
+        return choose_move(board, occupancy, to_move, moves_left, self.seconds,
+                           self.batch, self._pool, self.jobs)
+
+seat = Seat()
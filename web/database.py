@@ -12,19 +12,61 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
 import os
-from flask import current_app, g
+import threading
+from flask import current_app, g, has_app_context
 from werkzeug.local import LocalProxy
 
 from web import models
 
+# One engine (and connection pool) per database URL per process, created on
+# first use; sessions are per app context and closed on teardown.
+_engines = {}
+_sessionmakers = {}
+_engines_lock = threading.Lock()
 
-def setup():
+def _set_sqlite_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s=%s' % (name, value))
+        cursor.close()
+    return on_connect
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def query_count():
+    # Number of SQL statements run in the current app context.
+    return g.get('query_count', 0)
+
+def get_engine():
     database_url = current_app.config['ALCHEMY_DATABASE']
-    g.engine = create_engine(database_url)
-    g.db_session = sessionmaker(autocommit=False,autoflush=False,bind=g.engine)()
+    with _engines_lock:
+        engine = _engines.get(database_url)
+        if engine is None:
+            options = dict(current_app.config['ALCHEMY_ENGINE_OPTIONS'])
+            is_sqlite = make_url(database_url).get_backend_name() == 'sqlite'
+            if is_sqlite:
+                # Pooled connections move between greenlets and threads.
+                options.setdefault('connect_args', {'check_same_thread': False})
+            engine = create_engine(database_url, **options)
+            event.listen(engine, 'before_cursor_execute', _count_query)
+            if is_sqlite:
+                event.listen(engine, 'connect',
+                             _set_sqlite_pragmas(current_app.config['SQLITE_PRAGMAS']))
+            _engines[database_url] = engine
+            _sessionmakers[database_url] = sessionmaker(
+                autocommit=False, autoflush=False, bind=engine)
+    return engine
+
+def setup():
+    g.engine = get_engine()
+    g.db_session = _sessionmakers[current_app.config['ALCHEMY_DATABASE']]()
     # models.Base.query = g.db_session.query_property()
 
 def get_db_session():
@@ -34,5 +76,19 @@ def get_db_session():
 
 db_session = LocalProxy(get_db_session)
 
+def teardown(exception=None):
+    session = g.pop('db_session', None)
+    if session is not None:
+        if exception is not None:
+            session.rollback()
+        session.close()
+
+def dispose_engines():
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
+
 def init(engine):
     models.Base.metadata.create_all(bind=engine)
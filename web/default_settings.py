@@ -14,5 +14,38 @@
 
 import os
 
+from sqlalchemy.pool import QueuePool
+
 DATABASE=os.path.join('web','voro.db')
 ALCHEMY_DATABASE='sqlite:///'+os.path.join('web','voro.db')
+ALCHEMY_ENGINE_OPTIONS={
+    'poolclass': QueuePool,
+    'pool_size': 5,
+    'max_overflow': 10,
+}
+# Applied to every new SQLite connection.
+SQLITE_PRAGMAS={
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+QUERY_COUNT_HEADER=False # adds X-Query-Count to every response
+LIST_PAGE_SIZE=50 # rows per page of game, board and user listings
+BOARD_CACHE_SIZE=64
+BOARD_SVG_DIR=os.path.join('web','svg') # rendered board SVGs
+BOARD_MAX_AGE=365 * 24 * 3600 # seconds browsers may keep board payloads at versioned URLs
+SEND_QUEUE_SIZE=64 # per-socket outbound messages before eviction
+SEND_MAX_LAG=10.0 # seconds a queued message may wait before eviction
+RESUME_MAX_MOVES=64 # reconnecting clients further behind get a snapshot
+REPLAY_CHECKPOINT_INTERVAL=32 # moves between stored positions for replays
+LIVE_GAMES_SIZE=256 # games held in memory
+USER_CACHE_SIZE=1024 # users whose display data is cached
+USER_CACHE_TTL=60.0 # seconds before cached user data is reloaded
+MOVE_JOURNAL=os.path.join('web','moves.journal')
+WRITE_BEHIND_INTERVAL=0.5 # seconds between database writes of queued moves
+WRITE_BEHIND_BATCH=256 # queued moves that force an immediate write
+BOT_USERNAME=None # user the computer plays as in runws; None disables it
+BOT_MOVE_SECONDS=2.0 # search time per computer move
+BOT_BATCH=64 # random playouts run together for each tree leaf
+BOT_JOBS=1 # processes searching each computer move
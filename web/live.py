@@ -0,0 +1,330 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Live games are held in memory and are authoritative: moves are validated
+# and broadcast from here, then persisted by a write-behind queue.  Every
+# accepted move is first appended to a journal file, which is replayed into
+# the database on startup in case the process died with moves unwritten.
+
+from collections import OrderedDict
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from web import boards, models, rules
+from web.database import db_session
+
+logger = logging.getLogger(__name__)
+
+class LiveGame:
+    __slots__ = ('game_id', 'board_id', 'player_ids', 'position', 'moves')
+
+    def __init__(self, game_id, board_id, player_ids, status, tokens):
+        # The turn comes from the stored status; the tokens were already
+        # accepted, so they are placed without checking it.
+        self.game_id = game_id
+        self.board_id = board_id
+        self.player_ids = player_ids
+        self.position = rules.Position(boards.get_board(board_id),
+                                       status.get('to_move', 1),
+                                       status.get('moves_left', 1))
+        self.moves = []
+        for location, color in tokens:
+            self.position.place(location, color)
+            self.moves.append((location, color))
+
+    @classmethod
+    def from_model(cls, game):
+        tokens = (db_session.query(models.Token.location, models.Token.player)
+                  .filter_by(game_id=game.game_id)
+                  .order_by(models.Token.move_number, models.Token.token_id)
+                  .all())
+        return cls(game.game_id, game.board_id,
+                   (game.player1_id, game.player2_id),
+                   game.status(), tokens)
+
+    @property
+    def move_count(self):
+        return len(self.moves)
+
+    @property
+    def status(self):
+        return rules.status(self.position)
+
+    def play(self, user_id, location, color):
+        # Returns the move to persist, or None if the move is not allowed.
+        if color not in (1, 2):
+            return None
+        if user_id is None or user_id != self.player_ids[color - 1]:
+            return None
+        if not rules.apply_move(self.position, location, color):
+            return None
+        self.moves.append((location, color))
+        return {
+            'game_id': self.game_id,
+            'move_number': self.move_count,
+            'location': location,
+            'color': color,
+            'status': self.status,
+            'placed_on': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    def cells(self):
+        return (self.position.occupancy + ord('0')).tobytes().decode()
+
+# LRU of live games; evicting one is always safe, since its moves are
+# already queued for writing and loading flushes that queue first.
+class LiveGames:
+    def __init__(self, writer, maxsize=256):
+        self.writer = writer
+        self.maxsize = maxsize
+        self._games = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game_id, game_model=None, keep=True):
+        # keep=False loads a game without holding it, for workers that do
+        # not own it.
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is not None:
+                self._games.move_to_end(game_id)
+                return game
+        self.writer.flush()
+        if game_model is None:
+            game_model = db_session.query(models.Game).filter_by(game_id=game_id).first()
+        if game_model is None:
+            return None
+        game = LiveGame.from_model(game_model)
+        if not keep:
+            return game
+        with self._lock:
+            game = self._games.setdefault(game_id, game)
+            self._games.move_to_end(game_id)
+            while len(self._games) > self.maxsize:
+                evicted_id, unused_game = self._games.popitem(last=False)
+                logger.info('Evicted idle game %d from memory', evicted_id)
+        return game
+
+    def forget(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+class MoveConflict(Exception):
+    # A move that cannot be stored in order after the game's stored moves.
+    pass
+
+def persist_move(move):
+    # A move that is already stored, as when the journal is replayed, is
+    # skipped; any other gap or overlap with the stored moves is an error.
+    game = db_session.query(models.Game).filter_by(game_id=move['game_id']).first()
+    if game is None:
+        raise MoveConflict('Game %d does not exist' % move['game_id'])
+    move_count = game.move_count or 0
+    if move_count >= move['move_number']:
+        stored = (db_session.query(models.Token.token_id)
+                  .filter_by(game_id=move['game_id'], move_number=move['move_number'])
+                  .first())
+        if stored is not None:
+            return
+    if move_count != move['move_number'] - 1:
+        raise MoveConflict('Game %d has %d moves stored, not %d' % (
+            move['game_id'], move_count, move['move_number'] - 1))
+    game.move_count = move['move_number']
+    game.set_status(move['status'])
+    db_session.add(models.Token(
+        game_id=move['game_id'],
+        player=move['color'],
+        location=move['location'],
+        move_number=move['move_number'],
+        placed_on=datetime.datetime.fromisoformat(move['placed_on'])))
+    if 'cells' in move:
+        db_session.add(models.Checkpoint(
+            game_id=move['game_id'],
+            move_number=move['move_number'],
+            cells=bytes(ord(cell) - ord('0') for cell in move['cells']),
+            to_move=move['status']['to_move'],
+            moves_left=move['status']['moves_left']))
+
+class WriteBehind:
+    def __init__(self):
+        self.journal_path = None
+        self.interval = 0.5
+        self.batch_size = 256
+        self._pending = []
+        # The batch being stored by a flush, still readable through queued().
+        self._flushing = []
+        self._journal = None
+        self._app = None
+        self._flusher = None
+        # _lock guards the queue and the journal file; _flush_lock is held
+        # for a whole flush, so that batches are stored in the order they
+        # were queued.
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Journals holding moves that could not be stored, which are never
+        # truncated, so that those moves are not lost.
+        self._kept_journals = set()
+
+    def configure(self, journal_path, interval, batch_size):
+        self.journal_path = journal_path
+        self.interval = interval
+        self.batch_size = batch_size
+
+    def start(self, app, threaded=False):
+        # Without a running flusher, submit() writes through synchronously.
+        # The flusher is a greenlet, or a thread for servers without gevent.
+        self._app = app
+        if threaded:
+            self._flusher = threading.Thread(target=self._run, args=(time.sleep,),
+                                             name='write-behind', daemon=True)
+            self._flusher.start()
+        else:
+            import gevent
+            self._flusher = gevent.spawn(self._run, gevent.sleep)
+
+    def _run(self, sleep):
+        while True:
+            sleep(self.interval)
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Write-behind flush failed; will retry')
+                    db_session.rollback()
+
+    def submit(self, move):
+        # Journalled and queued together, so that a flush cannot truncate
+        # the journal under a move it has not taken.
+        with self._lock:
+            self._append_journal(move)
+            self._pending.append(move)
+            full = len(self._pending) >= self.batch_size
+        if self._flusher is None or full:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._flushing = batch
+            if not batch:
+                return
+            try:
+                for move in batch:
+                    persist_move(move)
+                db_session.commit()
+            except (IntegrityError, MoveConflict):
+                db_session.rollback()
+                self._write_individually(batch)
+            except:
+                db_session.rollback()
+                with self._lock:
+                    self._pending[:0] = batch
+                    self._flushing = []
+                raise
+            with self._lock:
+                self._flushing = []
+                if not self._pending:
+                    self._truncate_journal()
+        logger.info('Wrote %d moves', len(batch))
+
+    def queued(self, game_id):
+        # A game's moves not yet stored, in order, for readers that should
+        # not flush.  Moves stored since are included too, so callers take
+        # only those after the moves they read from the database.
+        with self._lock:
+            return [move for move in self._flushing + self._pending
+                    if move['game_id'] == game_id]
+
+    def _write_individually(self, batch):
+        # A move that cannot be stored (a cell already taken in the database,
+        # or a move out of order) is dropped, without holding back the rest
+        # of the batch; it stays in the journal.
+        for move in batch:
+            try:
+                persist_move(move)
+                db_session.commit()
+            except (IntegrityError, MoveConflict) as e:
+                db_session.rollback()
+                self._keep_journal(self.journal_path)
+                logger.error('Could not store move %s: %s', move, e)
+
+    def _keep_journal(self, journal_path):
+        if journal_path is not None and journal_path not in self._kept_journals:
+            self._kept_journals.add(journal_path)
+            logger.error('Keeping journal %s, which has moves not stored',
+                         journal_path)
+
+    def _append_journal(self, move):
+        if self.journal_path is None:
+            return
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write(json.dumps(move) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _truncate_journal(self):
+        if self._journal is not None and self.journal_path not in self._kept_journals:
+            self._journal.truncate(0)
+            self._journal.seek(0)
+
+    def replay_journal(self, journal_path=None):
+        # Writes any journalled moves missing from the database.  Must run
+        # before any games are loaded into memory.
+        if journal_path is None:
+            journal_path = self.journal_path
+        if journal_path is None or not os.path.exists(journal_path):
+            return 0
+        replayed = 0
+        with open(journal_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    move = json.loads(line)
+                except ValueError:
+                    logger.warning('Ignoring torn journal entry %r', line)
+                    continue
+                try:
+                    persist_move(move)
+                    db_session.commit()
+                except (IntegrityError, MoveConflict) as e:
+                    db_session.rollback()
+                    self._keep_journal(journal_path)
+                    logger.error('Could not store journalled move %s: %s', move, e)
+                    continue
+                replayed += 1
+        if journal_path not in self._kept_journals:
+            with open(journal_path, 'w'):
+                pass
+        return replayed
+
+writer = WriteBehind()
+games = LiveGames(writer)
+
+def configure(app):
+    games.maxsize = app.config['LIVE_GAMES_SIZE']
+    writer.configure(app.config['MOVE_JOURNAL'],
+                     app.config['WRITE_BEHIND_INTERVAL'],
+                     app.config['WRITE_BEHIND_BATCH'])
@@ -12,10 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from flask import Blueprint, render_template, redirect, url_for, request, session, current_app, g
-import jinja2
+from flask import Blueprint, render_template, redirect, url_for, request, session
+from markupsafe import Markup
+from sqlalchemy.exc import IntegrityError
 
-from web import models
+from web import models, users
 from web.database import db_session
 
 blueprint = Blueprint('login_null', __name__,
@@ -23,28 +24,20 @@ blueprint = Blueprint('login_null', __name__,
 
 @blueprint.app_template_global('login_row')
 def login_row():
-    current_app.logger.info('session: %s', session)
-    if 'user_id' in session:
-        user = db_session.query(models.User).filter_by(user_id=session['user_id']).first()
-    else:
-        user = None
-    return jinja2.Markup(render_template('login_row_null.html', user=user))
+    return Markup(render_template('login_row_null.html',
+                                  user=users.current_user()))
 
 @blueprint.route('/login', methods=['POST','GET'])
 def login():
-    current_app.logger.info('session: %s', session)
     if request.method=='POST':
         username = request.form['username']
-        user = db_session.query(models.User).filter_by(username=username).first()
-        if user is None:
+        user_id = (db_session.query(models.User.user_id)
+                   .filter_by(username=username).scalar())
+        if user_id is None:
             return 'User does not exist'
-        session['user_id'] = user.user_id
-    elif 'user_id' in session:
-        user = db_session.query(models.User).filter_by(user_id=session['user_id']).first()
-    else:
-        user = None
+        users.set_current_user(user_id)
     return render_template('login_null.html',
-         user=user)
+         user=users.current_user())
 
 @blueprint.route('/signup', methods=['POST'])
 def signup():
@@ -56,12 +49,16 @@ def signup():
         return 'User already exists'
     new_user = models.User(username=username, display_name=username)
     db_session.add(new_user)
-    db_session.commit()
+    try:
+        db_session.commit()
+    except IntegrityError:
+        db_session.rollback()
+        return 'User already exists'
     return redirect(url_for('login_null.login'))
 
 @blueprint.route('/logout', methods=['POST'])
 def logout():
     if 'user_id' not in session:
         return 'Not logged in'
-    del session['user_id']
+    users.set_current_user(None)
     return redirect(url_for('login_null.login'))
\ No newline at end of file
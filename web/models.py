@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, MetaData
+from sqlalchemy import Boolean, Column, Integer, Float, String, DateTime, ForeignKey, Index, LargeBinary, MetaData
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -32,41 +32,89 @@ class Board(Base):
 
     board_id=Column(Integer, primary_key=True)
     board_name=Column(String)
-    board_json=Column(String)
+    board_json=Column(String) # legacy boards only; see board_data
+    board_data=Column(LargeBinary) # builder.boardformat
+    num_cells=Column(Integer, index=True)
 
 class Game(Base):
     __tablename__ = 'games'
 
     game_id=Column(Integer, primary_key=True)
     game_name=Column(String)
-    board_id=Column(Integer, ForeignKey('boards.board_id'))
-    game_status_json=Column(String)
-    player1_id=Column(Integer, ForeignKey('users.user_id'))
-    player2_id=Column(Integer, ForeignKey('users.user_id'))
+    board_id=Column(Integer, ForeignKey('boards.board_id'), index=True)
+    player1_id=Column(Integer, ForeignKey('users.user_id'), index=True)
+    player2_id=Column(Integer, ForeignKey('users.user_id'), index=True)
+    move_count=Column(Integer, default=0) # version of the game state
+
+    # Game status, sent to clients as the dict from status().  Columns are
+    # NULL until the status has the corresponding key.
+    to_move=Column(Integer)
+    moves_left=Column(Integer)
+    border_full=Column(Boolean(create_constraint=False))
+    connections_remaining=Column(Float) # may be a half; see scoring
+    game_complete=Column(Boolean(create_constraint=False), default=False, index=True)
+    score_1=Column(Integer)
+    score_2=Column(Integer)
 
     board=relationship("Board", back_populates="games")
     player1=relationship("User", foreign_keys=[player1_id])
     player2=relationship("User", foreign_keys=[player2_id])
+
+    STATUS_KEYS = ('to_move', 'moves_left', 'border_full',
+                   'connections_remaining', 'game_complete', 'score_1', 'score_2')
+
+    def status(self):
+        status = {}
+        for key in self.STATUS_KEYS:
+            value = getattr(self, key)
+            if value is not None:
+                status[key] = value
+        if not self.game_complete:
+            status.pop('game_complete', None)
+        return status
+
+    def set_status(self, status):
+        for key in self.STATUS_KEYS:
+            setattr(self, key, status.get(key))
+        self.game_complete = bool(status.get('game_complete'))
     
 Board.games=relationship("Game", order_by=Game.game_id, back_populates="board")
 
 class Token(Base):
     __tablename__ = 'tokens'
+    __table_args__ = (
+        # One token per cell; also serves lookups by game.
+        Index('ix_tokens_game_id_location', 'game_id', 'location', unique=True),
+        # A game's move log, in order.
+        Index('ix_tokens_game_id_move_number', 'game_id', 'move_number'),
+    )
 
     token_id=Column(Integer, primary_key=True)
     game_id=Column(Integer, ForeignKey('games.game_id'))
     player=Column(Integer) # TODO: enum 1 or 2
     location=Column(Integer)
+    move_number=Column(Integer) # game's move_count after this token
     placed_on=Column(DateTime(timezone=True), default=func.now())
 
     game=relationship("Game", back_populates="tokens")
 
 Game.tokens=relationship("Token", order_by=Token.location, back_populates='game')
 
+# A game's position after move_number moves, stored every few moves so that
+# any position can be rebuilt from a nearby one.
+class Checkpoint(Base):
+    __tablename__ = 'checkpoints'
+
+    game_id=Column(Integer, ForeignKey('games.game_id'), primary_key=True)
+    move_number=Column(Integer, primary_key=True)
+    cells=Column(LargeBinary) # one byte per cell: 0 if empty, else the color
+    to_move=Column(Integer)
+    moves_left=Column(Integer)
+
 class User(Base):
     __tablename__ = 'users'
 
     user_id=Column(Integer, primary_key=True)
-    username=Column(String)
+    username=Column(String, index=True, unique=True)
     display_name=Column(String)
     user_extra_data_json=Column(String)
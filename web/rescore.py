@@ -0,0 +1,126 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Audit of stored game statuses: every game is scored again from its tokens
+# with rules.score, and games whose stored status disagrees are reported.
+
+import concurrent.futures
+import time
+
+from flask import Blueprint
+import click
+import numpy as np
+from sqlalchemy.orm import load_only
+
+from web import boards, models, rules
+from web.database import db_session
+
+blueprint = Blueprint('rescore', __name__, cli_group=None)
+
+def stored_scores(game):
+    return {key: value for key, value in game.status().items()
+            if key in rules.SCORE_KEYS}
+
+def rules_board(board_id):
+    # Just the arrays the rules need, which are cheap to send to workers.
+    board = boards.get_board(board_id)
+    return rules.Board(board.num_cells, board.num_border, board.indptr, board.indices)
+
+def game_batches(chunk_size):
+    # Reads games and their tokens chunk_size games at a time, in game_id
+    # order, and yields them as (board_id, games) batches for
+    # rules.check_scores.
+    columns = [getattr(models.Game, key)
+               for key in ('game_id', 'board_id') + models.Game.STATUS_KEYS]
+    after = 0
+    while True:
+        games = (db_session.query(models.Game).options(load_only(*columns))
+                 .filter(models.Game.game_id > after)
+                 .order_by(models.Game.game_id)
+                 .limit(chunk_size).all())
+        if not games:
+            return
+        after = games[-1].game_id
+        tokens = np.array(
+            db_session.query(models.Token.game_id, models.Token.location,
+                             models.Token.player)
+            .filter(models.Token.game_id.between(games[0].game_id, after))
+            .order_by(models.Token.game_id).all(),
+            dtype=np.int64).reshape(-1, 3)
+        game_ids = np.array([game.game_id for game in games])
+        starts = np.searchsorted(tokens[:, 0], game_ids, side='left')
+        ends = np.searchsorted(tokens[:, 0], game_ids, side='right')
+        batches = {}
+        for game, start, end in zip(games, starts, ends):
+            batches.setdefault(game.board_id, []).append((
+                game.game_id, stored_scores(game),
+                tokens[start:end, 1], tokens[start:end, 2]))
+        db_session.expunge_all()
+        yield from batches.items()
+
+def fix_games(wrong):
+    # Stores the computed scoring, keeping each game's turn.
+    computed = {game_id: scores for game_id, unused_stored, scores in wrong}
+    games = (db_session.query(models.Game)
+             .filter(models.Game.game_id.in_(list(computed))).all())
+    for game in games:
+        status = game.status()
+        game.set_status(dict(computed[game.game_id], to_move=status.get('to_move'),
+                             moves_left=status.get('moves_left')))
+    db_session.commit()
+
+@blueprint.cli.command('rescore')
+@click.option('--chunk-size', type=int, default=1000,
+              help='Games to read from the database at a time.')
+@click.option('--jobs', type=int, default=1, help='Worker processes.')
+@click.option('--fix/--no-fix', default=False,
+              help='Whether to store the computed status of games that disagree.')
+def rescore(chunk_size, jobs, fix):
+    # Exits with an error if any game disagrees, unless --fix stored the
+    # computed status.  Live games held by a running server are not updated.
+    start = time.perf_counter()
+    checked = 0
+    wrong = []
+
+    def finished(result):
+        for game_id, stored, computed in result:
+            click.echo('game %d: stored %s, computed %s' % (game_id, stored, computed))
+        wrong.extend(result)
+
+    if jobs == 1:
+        for board_id, games in game_batches(chunk_size):
+            checked += len(games)
+            finished(rules.check_scores(rules_board(board_id), games))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            pending = set()
+            for board_id, games in game_batches(chunk_size):
+                checked += len(games)
+                pending.add(pool.submit(rules.check_scores, rules_board(board_id), games))
+                # Reading runs ahead of scoring by at most two batches per worker.
+                if len(pending) >= 2 * jobs:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        finished(future.result())
+            for future in concurrent.futures.as_completed(pending):
+                finished(future.result())
+
+    click.echo('%d games rescored in %.2fs, %d disagree' % (
+        checked, time.perf_counter() - start, len(wrong)), err=True)
+    if wrong and fix:
+        fix_games(wrong)
+        click.echo('Fixed %d games' % len(wrong), err=True)
+    elif wrong:
+        raise click.ClickException('%d games have a wrong status' % len(wrong))
@@ -0,0 +1,235 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from collections import deque
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def merge_deltas(older, newer):
+    # A delta carries the moves after version - len(moves) up to version.
+    # A resume reply and a broadcast can cover the same moves, so the older
+    # moves are kept only up to where the newer delta starts.  Deltas that
+    # leave a gap or go backwards are not merged.
+    older_first = older['version'] - len(older['moves'])
+    newer_first = newer['version'] - len(newer['moves'])
+    if not older_first <= newer_first <= older['version'] <= newer['version']:
+        return None
+    return {
+        'action': 'GAME_DELTA',
+        'version': newer['version'],
+        'moves': older['moves'][:newer_first - older_first] + newer['moves'],
+        'status': newer['status'],
+    }
+
+# How to fold a message into an unsent one of the same action, so a client
+# that falls behind gets one combined frame instead of the whole backlog.
+# A coalescer returns None if the two cannot be combined.
+COALESCERS = {
+    'GAME_DELTA': merge_deltas,
+}
+
+metrics = {
+    'sent': 0,
+    'coalesced': 0,
+    'evicted': 0,
+}
+
+# Owns a socket's outbound traffic.  Messages go into a bounded queue that a
+# dedicated greenlet drains, so whoever broadcasts never waits on the
+# network.  A client whose queue overflows, or that has had a message
+# waiting for more than max_lag seconds, is disconnected.
+class SocketSender:
+    def __init__(self, ws, max_queue=64, max_lag=10.0):
+        self.ws = ws
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.closed = False
+        self._queue = deque()
+        self._sending_since = None
+        self._wakeup = None
+        self._greenlet = None
+
+    def start(self):
+        import gevent
+        from gevent.event import Event
+        self._wakeup = Event()
+        self._greenlet = gevent.spawn(self._drain)
+        return self
+
+    def send(self, data, message=None):
+        # Queues pre-serialized data; message is the same frame as a dict,
+        # needed only to coalesce it with an unsent frame.
+        if self.closed:
+            return False
+        now = time.monotonic()
+        oldest = self._sending_since
+        if self._queue and (oldest is None or self._queue[0][2] < oldest):
+            oldest = self._queue[0][2]
+        if oldest is not None and now - oldest > self.max_lag:
+            self.evict('lagging %.1fs behind' % (now - oldest))
+            return False
+        action = message.get('action') if message else None
+        if action in COALESCERS and self._queue and self._queue[-1][1]:
+            last_data, last_message, queued = self._queue[-1]
+            if last_message.get('action') == action:
+                merged = COALESCERS[action](last_message, message)
+                if merged is not None:
+                    self._queue[-1] = (json.dumps(merged), merged, queued)
+                    metrics['coalesced'] += 1
+                    return True
+        if len(self._queue) >= self.max_queue:
+            self.evict('send queue full')
+            return False
+        self._queue.append((data, message, now))
+        self._wake()
+        return True
+
+    def _wake(self):
+        self._wakeup.set()
+
+    def _drain(self):
+        while not self.closed:
+            if not self._queue:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+            data, unused_message, unused_queued = self._queue.popleft()
+            self._sending_since = time.monotonic()
+            try:
+                self.ws.send(data)
+            except Exception:
+                logger.info('Send failed, closing sender', exc_info=True)
+                self.close()
+                return
+            self._sending_since = None
+            metrics['sent'] += 1
+
+    def evict(self, reason):
+        logger.warning('Evicting slow client: %s', reason)
+        metrics['evicted'] += 1
+        self.close()
+        import gevent
+        gevent.spawn(self._close_socket)
+
+    def _close_socket(self):
+        try:
+            self.ws.close()
+        except Exception:
+            logger.info('Error closing evicted socket', exc_info=True)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+# The same queue for an aiohttp socket on an asyncio loop.  The drain task
+# only exists while there is something to send, so an idle spectator costs
+# no more than its socket.  Created on the loop's thread; sends from other
+# threads, such as moves handled on the server's pool, are passed to it.
+class AsyncSocketSender(SocketSender):
+    def __init__(self, ws, max_queue=64, max_lag=10.0):
+        super().__init__(ws, max_queue, max_lag)
+        self._task = None
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+
+    def start(self):
+        return self
+
+    def send(self, data, message=None):
+        if threading.get_ident() != self._thread:
+            # Sends are queued on the loop in the order they were made.
+            self._loop.call_soon_threadsafe(super().send, data, message)
+            return not self.closed
+        return super().send(data, message)
+
+    def _wake(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._drain())
+
+    async def _drain(self):
+        try:
+            while self._queue and not self.closed:
+                data, unused_message, unused_queued = self._queue.popleft()
+                self._sending_since = time.monotonic()
+                try:
+                    await self.ws.send_str(data)
+                except Exception:
+                    logger.info('Send failed, closing sender', exc_info=True)
+                    self.close()
+                    return
+                self._sending_since = None
+                metrics['sent'] += 1
+        finally:
+            self._task = None
+
+    def evict(self, reason):
+        logger.warning('Evicting slow client: %s', reason)
+        metrics['evicted'] += 1
+        self.close()
+        asyncio.ensure_future(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.ws.close()
+        except Exception:
+            logger.info('Error closing evicted socket', exc_info=True)
+
+# Maps each game_id to the senders subscribed to it, so a broadcast only
+# touches the sockets watching that game.
+class RoomRegistry:
+    def __init__(self):
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def join(self, game_id, sender):
+        with self._lock:
+            self._rooms.setdefault(game_id, set()).add(sender)
+
+    def leave(self, game_id, sender):
+        with self._lock:
+            room = self._rooms.get(game_id)
+            if room is None:
+                return
+            room.discard(sender)
+            if not room:
+                del self._rooms[game_id]
+
+    def subscribers(self, game_id):
+        with self._lock:
+            return list(self._rooms.get(game_id, ()))
+
+    def broadcast(self, game_id, message):
+        data = json.dumps(message)
+        for sender in self.subscribers(game_id):
+            if not sender.send(data, message):
+                self.leave(game_id, sender)
+
+    def subscriber_count(self, game_id):
+        with self._lock:
+            return len(self._rooms.get(game_id, ()))
+
+    def subscriber_counts(self):
+        with self._lock:
+            return {game_id: len(room) for game_id, room in self._rooms.items()}
+
+registry = RoomRegistry()
@@ -0,0 +1,218 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The rules of the game on plain arrays, with no Flask or database, so that
+# games can be simulated or re-scored anywhere.  A board is anything with
+# num_cells, num_border and a CSR adjacency (indptr, indices), such as a
+# boards.CompiledBoard or a Board from make_board().  Colors are 1 (red)
+# and 2 (blue), and 0 is an empty cell.
+#
+# Red places one token first, then the players take turns placing two.
+# The game is over once the border is full and every border group that
+# can be is connected; see score() for how it is scored.
+
+from collections import namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from builder import boardformat
+from web.scoring import IncrementalScorer
+
+Board = namedtuple('Board', ['num_cells', 'num_border', 'indptr', 'indices'])
+
+def make_board(num_cells, edges, num_border):
+    indptr, indices = boardformat.adjacency(
+        num_cells, np.asarray(edges, dtype=np.intp).reshape(-1, 2))
+    return Board(num_cells, num_border, indptr, indices)
+
+def board_edges(board):
+    # Each edge once, as (i, j) rows with i < j.
+    sources = np.repeat(np.arange(board.num_cells), np.diff(board.indptr))
+    edges = np.stack([sources, board.indices], axis=1)
+    return edges[edges[:, 0] < edges[:, 1]]
+
+# A game in progress: the occupancy, whose turn it is, and the incremental
+# scorer, which keeps status() cheap after every move.
+class Position:
+    __slots__ = ('board', 'occupancy', 'to_move', 'moves_left',
+                 'move_count', 'scorer')
+
+    def __init__(self, board, to_move=1, moves_left=1):
+        self.board = board
+        self.occupancy = np.zeros(board.num_cells, dtype=np.int8)
+        self.to_move = to_move
+        self.moves_left = moves_left
+        self.move_count = 0
+        self.scorer = IncrementalScorer.from_csr(
+            board.indptr, board.indices, board.num_border)
+
+    def place(self, location, color):
+        # Places a token without checking whose turn it is, for loading
+        # moves that were already accepted.
+        self.occupancy[location] = color
+        self.move_count += 1
+        self.scorer.place(location, color)
+
+    @property
+    def complete(self):
+        remaining = self.scorer.connections_remaining()
+        return remaining is not None and remaining <= 0
+
+def next_turn(to_move, moves_left):
+    # The (to_move, moves_left) after one move.
+    if moves_left > 1:
+        return to_move, moves_left - 1
+    return (2 if to_move == 1 else 1), 2
+
+def move_colors(to_move, moves_left, count):
+    # The colors of the next count moves, as an array.
+    other = 2 if to_move == 1 else 1
+    pair = (np.arange(count) - moves_left) // 2
+    return np.where((pair < 0) | (pair % 2 == 1), to_move, other).astype(np.int8)
+
+def apply_move(position, location, color):
+    # Plays a move if it is legal; returns whether it was.
+    if color != position.to_move or position.complete:
+        return False
+    if not 0 <= location < len(position.occupancy) or position.occupancy[location]:
+        return False
+    position.to_move, position.moves_left = next_turn(position.to_move,
+                                                      position.moves_left)
+    position.place(location, color)
+    return True
+
+def legal_moves(position):
+    # The cells the player to move may play in.
+    if position.complete:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(position.occupancy == 0)
+
+def status(position):
+    # The game status as stored and sent to clients; only the turn until
+    # the first move.
+    game_status = {
+        'to_move': position.to_move,
+        'moves_left': position.moves_left,
+    }
+    if position.move_count:
+        position.scorer.update_status(game_status)
+    return game_status
+
+def _components(num_nodes, edges):
+    # Edges must be sorted by their first node, as board_edges() and any
+    # subset of it are, so that the CSR matrix can be built directly.
+    indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+    np.cumsum(np.bincount(edges[:, 0], minlength=num_nodes), out=indptr[1:])
+    graph = csr_matrix((np.ones(len(edges), dtype=np.int8),
+                        edges[:, 1].astype(np.int32), indptr),
+                       shape=(num_nodes, num_nodes))
+    return connected_components(graph, directed=False)
+
+def score(board, occupancy):
+    # The scoring part of the status, computed from scratch.  Until the
+    # border is full, that is just border_full.  Then connections_remaining
+    # counts the merges of border-touching groups still possible, where two
+    # groups on the border ring count as half a connection.  At zero the
+    # game is complete: a group touching the border at several cells scores
+    # that many points for its owner and 4 for the opponent, and one touching
+    # it at a single cell scores 1 for the opponent.
+    #
+    # Groups are labelled as connected components of the graph of edges
+    # between same-color cells, all at once.
+    cells = np.asarray(occupancy)
+    num_border = board.num_border
+    if not cells[:num_border].all():
+        return {'border_full': False}
+    edges = board_edges(board)
+    same = edges[(cells[edges[:, 0]] == cells[edges[:, 1]])
+                 & (cells[edges[:, 0]] != 0)]
+    num_outer_groups, unused_labels = _components(
+        num_border, same[(same < num_border).all(axis=1)])
+    num_labels, labels = _components(board.num_cells, same)
+    border_labels = labels[:num_border]
+    weights = np.bincount(border_labels, minlength=num_labels)
+    groups = np.flatnonzero(weights)
+    remaining_connections = len(groups) - num_outer_groups / 2 - 1
+    result = {
+        'border_full': True,
+        'connections_remaining': remaining_connections,
+    }
+    if remaining_connections > 0:
+        return result
+    colors = np.zeros(num_labels, dtype=cells.dtype)
+    colors[border_labels] = cells[:num_border]
+    weights = weights[groups]
+    red = colors[groups] == 1
+    big = weights > 1
+    # A big group scores its weight for its owner and 4 for the opponent;
+    # a single-cell one scores 1 for the opponent.
+    result['game_complete'] = True
+    result['score_1'] = int(weights[big & red].sum() + 4 * np.count_nonzero(big & ~red)
+                            + np.count_nonzero(~big & ~red))
+    result['score_2'] = int(weights[big & ~red].sum() + 4 * np.count_nonzero(big & red)
+                            + np.count_nonzero(~big & red))
+    return result
+
+def score_many(board, occupancies):
+    # The scores of many full boards at once, as an (N, 2) array, counted as
+    # score() counts them for a completed game.  The boards are labelled
+    # together, as disconnected copies in one graph.
+    occupancies = np.asarray(occupancies)
+    count, num_cells = occupancies.shape
+    num_border = board.num_border
+    edges = board_edges(board)
+    first = occupancies[:, edges[:, 0]]
+    rows, columns = np.nonzero((first == occupancies[:, edges[:, 1]]) & (first != 0))
+    offsets = rows * num_cells
+    num_labels, labels = _components(count * num_cells, np.stack(
+        [edges[columns, 0] + offsets, edges[columns, 1] + offsets], axis=1))
+    border_nodes = (np.arange(count)[:, None] * num_cells
+                    + np.arange(num_border)).ravel()
+    border_labels = labels[border_nodes]
+    weights = np.bincount(border_labels, minlength=num_labels)
+    groups = np.flatnonzero(weights)
+    owners = np.zeros(num_labels, dtype=np.intp)
+    owners[border_labels] = border_nodes // num_cells
+    colors = np.zeros(num_labels, dtype=occupancies.dtype)
+    colors[border_labels] = occupancies[:, :num_border].ravel()
+    weights = weights[groups]
+    red = colors[groups] == 1
+    big = weights > 1
+    owners = owners[groups]
+    points_1 = np.where(big, np.where(red, weights, 4), np.where(red, 0, 1))
+    points_2 = np.where(big, np.where(red, 4, weights), np.where(red, 1, 0))
+    return np.stack([np.bincount(owners, weights=points_1, minlength=count),
+                     np.bincount(owners, weights=points_2, minlength=count)],
+                    axis=1).astype(np.int64)
+
+# The keys of a game status that score() computes.
+SCORE_KEYS = ('border_full', 'connections_remaining', 'game_complete',
+              'score_1', 'score_2')
+
+def check_scores(board, games):
+    # Rescores games on one board.  games holds (game_id, stored, locations,
+    # colors) tuples, where stored is the SCORE_KEYS part of the game's
+    # status; returns (game_id, stored, computed) for each one that is wrong.
+    wrong = []
+    occupancy = np.zeros(board.num_cells, dtype=np.int8)
+    for game_id, stored, locations, colors in games:
+        occupancy[:] = 0
+        occupancy[locations] = colors
+        # Games with no moves have only the turn in their status.
+        computed = score(board, occupancy) if len(locations) else {}
+        if computed != stored:
+            wrong.append((game_id, stored, computed))
+    return wrong
@@ -0,0 +1,102 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from web.unionfind import UnionFind
+
+# Incremental counterpart of rules.score.  Tokens are never removed, so
+# every quantity score() derives from a fresh UnionFind can instead be
+# kept up to date by merging only the edges around each newly placed cell.
+class IncrementalScorer:
+    def __init__(self, neighbors, num_border):
+        num_cells = len(neighbors)
+        self.num_cells = num_cells
+        self.num_border = num_border
+        self.neighbors = neighbors
+        self.cells = [None for i in range(num_cells)]
+        self.num_tokens = 0
+        self.empty_border = num_border
+        # Same-color groups over the whole board, weighted by border cells.
+        self.groups = UnionFind(num_cells)
+        self.groups.custom_weights[:num_border] = [1] * num_border
+        self.num_groups = num_border
+        # Same-color groups along the border ring only.
+        self.outer = UnionFind(num_border)
+        self.num_outer_groups = num_border
+        self.scores = [0, 0]
+
+    @classmethod
+    def from_csr(cls, indptr, indices, num_border):
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        return cls([indices[indptr[i]:indptr[i+1]] for i in range(len(indptr) - 1)],
+                   num_border)
+
+    def place(self, location, player):
+        if self.cells[location] is not None:
+            raise ValueError('Cell %d is already occupied' % location)
+        self.cells[location] = player
+        self.num_tokens += 1
+        if location < self.num_border:
+            self.empty_border -= 1
+        self._score_group(location, 1)
+        for j in self.neighbors[location]:
+            if self.cells[j] != player:
+                continue
+            if location < self.num_border and j < self.num_border:
+                if self.outer.find(location) != self.outer.find(j):
+                    self.outer.merge(location, j)
+                    self.num_outer_groups -= 1
+            self._merge(location, j)
+
+    def _merge(self, i, j):
+        i = self.groups.find(i)
+        j = self.groups.find(j)
+        if i == j:
+            return
+        self._score_group(i, -1)
+        self._score_group(j, -1)
+        weights = self.groups.custom_weights
+        if weights[i] > 0 and weights[j] > 0:
+            self.num_groups -= 1
+        self.groups.merge(i, j)
+        self._score_group(self.groups.find(i), 1)
+
+    def _score_group(self, root, sign):
+        weight = self.groups.custom_weights[root]
+        if weight == 0:
+            return
+        player = 0 if self.cells[root] == 1 else 1
+        if weight > 1:
+            self.scores[player] += sign * weight
+            self.scores[1 - player] += sign * 4
+        else:
+            self.scores[1 - player] += sign
+
+    def connections_remaining(self):
+        # None until the border is full.
+        if self.empty_border > 0:
+            return None
+        return self.num_groups - self.num_outer_groups / 2 - 1
+
+    def update_status(self, game_status):
+        remaining_connections = self.connections_remaining()
+        if remaining_connections is None:
+            game_status['border_full'] = False
+            return
+        game_status['border_full'] = True
+        game_status['connections_remaining'] = remaining_connections
+        if remaining_connections > 0:
+            return
+        game_status['game_complete'] = True
+        game_status['score_1'], game_status['score_2'] = self.scores
@@ -0,0 +1,304 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Multi-worker mode for runws.  Each game is owned by one worker, picked by
+# hashing its game_id, which holds the game's authoritative state and
+# applies its moves one at a time.  Workers pass messages to each other
+# over a bus:
+#
+#   play       a move from a socket on another worker, sent to the owner
+#   broadcast  a frame from the owner, for sockets on every other worker
+#   resume     a RESUME from a socket on another worker, sent to the owner
+#   frame      the owner's reply to a resume, sent back to the asker
+#
+# The bus is a set of named endpoints.  UnixEndpoint sends JSON datagrams
+# between Unix domain sockets in one directory; LocalHub connects endpoints
+# within one process, for tests.  With a single worker nothing is sent.
+
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import tempfile
+import zlib
+
+from web import database, live, rooms
+
+logger = logging.getLogger(__name__)
+
+def worker_name(index):
+    return 'worker-%d' % index
+
+def owner(game_id, workers):
+    return zlib.crc32(b'%d' % game_id) % workers
+
+class LocalHub:
+    def __init__(self):
+        self._handlers = {}
+
+    def endpoint(self, name):
+        return LocalEndpoint(self, name)
+
+class LocalEndpoint:
+    def __init__(self, hub, name):
+        self.hub = hub
+        self.name = name
+
+    def listen(self, handler):
+        self.hub._handlers[self.name] = handler
+
+    def send(self, peer, message):
+        # Round-trips through JSON, as the other endpoints do.
+        self.hub._handlers[peer](json.loads(json.dumps(message)))
+
+    def close(self):
+        self.hub._handlers.pop(self.name, None)
+
+class UnixEndpoint:
+    # Datagrams keep message boundaries, and arrive reliably and in order
+    # between two sockets on one host.  A sendto fails while the peer's
+    # queue is full, so sends go through an outbox drained by one greenlet,
+    # and received messages through an inbox drained by another: neither
+    # socket waits on the handler, and two workers sending to each other
+    # cannot deadlock.
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self._socket = None
+        self._outbox = None
+        self._greenlets = []
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.sock')
+
+    def listen(self, handler):
+        import gevent
+        from gevent import socket as gsocket
+        from gevent.queue import Queue
+        self._socket = gsocket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path(self.name))
+        # A plain socket: gevent's sendto drops the datagram, returning 0,
+        # if the peer's queue is still full after one wait.
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.setblocking(False)
+        inbox = Queue()
+        self._outbox = Queue()
+
+        def receive():
+            while True:
+                inbox.put(self._socket.recv(1 << 20))
+
+        def dispatch():
+            for data in inbox:
+                try:
+                    handler(json.loads(data))
+                except Exception:
+                    logger.exception('Error handling bus message %r', data)
+
+        def transmit():
+            for peer, data in self._outbox:
+                while True:
+                    try:
+                        sender.sendto(data, self.path(peer))
+                        break
+                    except BlockingIOError:
+                        # The peer's queue is full; try again shortly.
+                        gevent.sleep(0.001)
+                    except OSError:
+                        logger.exception('Could not send bus message to %s', peer)
+                        break
+
+        self._greenlets = [gevent.spawn(receive), gevent.spawn(dispatch),
+                           gevent.spawn(transmit)]
+
+    def send(self, peer, message):
+        self._outbox.put((peer, json.dumps(message).encode()))
+
+    def close(self):
+        if self._socket is not None:
+            import gevent
+            gevent.killall(self._greenlets)
+            self._socket.close()
+            os.unlink(self.path(self.name))
+
+class Shard:
+    def __init__(self):
+        self.index = 0
+        self.workers = 1
+        self.endpoint = None
+        self.observers = ()
+        self._app = None
+        self._requests = itertools.count()
+        self._pending = {}
+
+    def configure(self, app, index, workers, endpoint, observers=()):
+        # observers are endpoints that receive every broadcast without
+        # owning games, such as a load test.
+        self._app = app
+        self.index = index
+        self.workers = workers
+        self.endpoint = endpoint
+        self.observers = tuple(observers)
+        endpoint.listen(self.handle)
+
+    def owner(self, game_id):
+        return owner(game_id, self.workers)
+
+    def owns(self, game_id):
+        return self.owner(game_id) == self.index
+
+    def play(self, user_id, game_id, location, color):
+        if self.owns(game_id):
+            from web import voro
+            voro.play_token(user_id, game_id, location, color)
+            return
+        self.endpoint.send(worker_name(self.owner(game_id)), {
+            'type': 'play',
+            'user_id': user_id,
+            'game_id': game_id,
+            'location': location,
+            'color': color,
+        })
+
+    def resume(self, game_id, version, sender):
+        if self.owns(game_id):
+            from web import voro
+            frame = voro.resume_frame(game_id, version)
+            sender.send(json.dumps(frame), frame)
+            return
+        request = next(self._requests)
+        self._pending[request] = sender
+        self.endpoint.send(worker_name(self.owner(game_id)), {
+            'type': 'resume',
+            'game_id': game_id,
+            'version': version,
+            'reply_to': self.endpoint.name,
+            'request': request,
+        })
+
+    def publish(self, game_id, message):
+        rooms.registry.broadcast(game_id, message)
+        if self.endpoint is None:
+            return
+        peers = [worker_name(i) for i in range(self.workers) if i != self.index]
+        for peer in peers + list(self.observers):
+            self.endpoint.send(peer, {
+                'type': 'broadcast',
+                'game_id': game_id,
+                'message': message,
+            })
+
+    def handle(self, message):
+        from web import voro
+        kind = message['type']
+        if kind == 'broadcast':
+            rooms.registry.broadcast(message['game_id'], message['message'])
+            return
+        if kind == 'frame':
+            sender = self._pending.pop(message['request'], None)
+            if sender is not None:
+                sender.send(json.dumps(message['frame']), message['frame'])
+            return
+        with self._app.app_context():
+            if kind == 'play':
+                voro.play_token(message['user_id'], message['game_id'],
+                                message['location'], message['color'])
+            elif kind == 'resume':
+                self.endpoint.send(message['reply_to'], {
+                    'type': 'frame',
+                    'request': message['request'],
+                    'frame': voro.resume_frame(message['game_id'], message['version']),
+                })
+            else:
+                logger.warning('Unknown bus message %s', message)
+
+    def forget(self, sender):
+        # Drops replies still owed to a closed socket.
+        for request, pending in list(self._pending.items()):
+            if pending is sender:
+                del self._pending[request]
+
+shard = Shard()
+
+def reuse_port_listener(port):
+    from gevent import socket as gsocket
+    listener = gsocket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listener.bind(('', port))
+    listener.listen(1024)
+    return listener
+
+def start_worker(app, index, workers, directory, observers=()):
+    # Runs in a freshly forked worker: sets up its shard and its own journal.
+    import gevent
+    gevent.reinit()
+    shard.configure(app, index, workers,
+                    UnixEndpoint(directory, worker_name(index)), observers)
+    live.writer.journal_path = '%s.%d' % (app.config['MOVE_JOURNAL'], index)
+    live.writer.start(app)
+
+def fork_workers(workers, run):
+    # Forks a process per worker running run(index); returns their pids.
+    pids = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run(index)
+            except BaseException:
+                logger.exception('Worker %d failed', index)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    return pids
+
+def stop_workers(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+def serve(app, port, workers, serve_listener):
+    # Runs workers that share the port through SO_REUSEPORT, so the kernel
+    # spreads connections across them; serve_listener(listener) serves
+    # HTTP and sockets on it forever.
+    directory = tempfile.mkdtemp(prefix='voro-bus-')
+    # Workers open their own database connections.
+    database.teardown()
+    database.dispose_engines()
+
+    def run(index):
+        start_worker(app, index, workers, directory)
+        serve_listener(reuse_port_listener(port))
+
+    pids = fork_workers(workers, run)
+    logger.info('Started %d workers: %s', workers, pids)
+    try:
+        # Serves until interrupted, or until any worker exits.
+        pid, status = os.wait()
+        logger.error('Worker %d exited with status %d', pid, status)
+    finally:
+        stop_workers(pids)
+        for name in os.listdir(directory):
+            os.unlink(os.path.join(directory, name))
+        os.rmdir(directory)
@@ -0,0 +1,87 @@
+/**
+ * Copyright 2020 Google LLC
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+var SVG_NS = 'http://www.w3.org/2000/svg';
+
+// Reads a board in the binary format (see builder/boardformat.py) into
+// typed arrays; all of its arrays start on 8-byte boundaries.
+function decode_board(buffer) {
+    var header = new DataView(buffer, 0, 24);
+    var magic = String.fromCharCode.apply(null, new Uint8Array(buffer, 0, 4));
+    if (magic !== 'VORB' || header.getUint16(4, true) !== 1) {
+        throw new Error('Unsupported board format');
+    }
+    var num_cells = header.getUint32(8, true);
+    var num_edges = header.getUint32(16, true);
+    return {
+        num_border: header.getUint32(12, true),
+        coords: new Float64Array(buffer, 24, num_cells * 2),
+        edges: new Int32Array(buffer, 24 + num_cells * 16, num_edges * 2),
+    };
+}
+
+function svg_element(name, attributes) {
+    var element = document.createElementNS(SVG_NS, name);
+    for (var key in attributes) {
+        element.setAttribute(key, attributes[key]);
+    }
+    return element;
+}
+
+// Draws the board as the server used to: coordinates shifted into a
+// 44x44 view box, with cells sized from the shortest edge.
+function draw_board(board) {
+    var coords = board.coords;
+    var edges = board.edges;
+    var svg = svg_element('svg', {viewBox: '0 0 44 44'});
+    var min_length = Infinity;
+    for (var k = 0; k < edges.length; k += 2) {
+        var i = edges[k], j = edges[k + 1];
+        var dx = coords[2*i] - coords[2*j], dy = coords[2*i + 1] - coords[2*j + 1];
+        min_length = Math.min(min_length, Math.sqrt(dx*dx + dy*dy));
+        svg.appendChild(svg_element('line', {
+            x1: coords[2*i] + 22, y1: coords[2*i + 1] + 22,
+            x2: coords[2*j] + 22, y2: coords[2*j + 1] + 22,
+            stroke: 'black', 'stroke-width': '0.5%',
+        }));
+    }
+    var radius = min_length * 0.45;
+    for (var n = 0; n < coords.length / 2; n++) {
+        var cell = svg_element('circle', {
+            id: 'cell-' + n, 'data-num': n, 'class': 'voro-cell',
+            cx: coords[2*n] + 22, cy: coords[2*n + 1] + 22, r: radius,
+            'fill-opacity': 0,
+        });
+        var title = svg_element('title', {});
+        title.textContent = 'Cell ' + n;
+        cell.appendChild(title);
+        svg.appendChild(cell);
+    }
+    return svg;
+}
+
+// Fetches the geometry named by the holder's data-geometry attribute and
+// draws the board into it.  The geometry is cached by the browser, so pages
+// only carry the per-game state.
+function load_board(holder, callback) {
+    fetch(holder.dataset.geometry)
+        .then(function(response) { return response.arrayBuffer(); })
+        .then(function(buffer) {
+            holder.textContent = '';
+            holder.appendChild(draw_board(decode_board(buffer)));
+            callback(holder.getElementsByClassName('voro-cell'));
+        });
+}
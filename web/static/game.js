@@ -15,8 +15,13 @@
  */
 
 var game_status = {};
+var game_version = 0;
 var protocol = location.protocol == 'http:' ? 'ws:' : 'wss:';
-var sock = new WebSocket(protocol + location.host + location.pathname);
+var socket_url = protocol + location.host + location.pathname;
+var sock = null;
+var reconnect_delay = 500;
+// Set once the server reports an error, after which reconnecting is pointless.
+var stopped = false;
 
 function set_status(new_status) {
     old_status = game_status;
@@ -50,23 +55,83 @@ function set_status(new_status) {
     game_status = new_status;
 }
 
-sock.onmessage = function(event) {
-    data = JSON.parse(event.data);
-    console.log(data)
-    if (data.action === 'PLAY_TOKEN') {
-        var token_id = data.location;
-        var cell = document.getElementById('cell-' + token_id);
-        cell.classList.add('voro-token-' + data.color)
-        cell.classList.add('voro-cell-clicked');
+function set_version(version) {
+    game_version = version;
+}
+
+function place_token(location, color) {
+    var cell = document.getElementById('cell-' + location);
+    cell.classList.remove('voro-token-1', 'voro-token-2');
+    cell.classList.add('voro-token-' + color);
+    cell.classList.add('voro-cell-clicked');
+}
+
+function apply_delta(data) {
+    var first = data.version - data.moves.length;
+    if (first > game_version) {
+        // Missed some moves; ask for them again.
+        send_json({action: 'RESUME', version: game_version});
+        return;
+    }
+    for (var i = game_version - first; i < data.moves.length; i++) {
+        place_token(data.moves[i][0], data.moves[i][1]);
     }
-    if (data.action === 'NEW_GAME_STATUS') {
+    if (data.version >= game_version) {
         set_status(data.status);
-        //TODO: interface to show game status
+        game_version = data.version;
     }
-};
+}
+
+function apply_snapshot(data) {
+    for (var i = 0; i < data.cells.length; i++) {
+        var cell = document.getElementById('cell-' + i);
+        if (data.cells[i] === '0') {
+            cell.classList.remove('voro-token-1', 'voro-token-2', 'voro-cell-clicked');
+        } else {
+            place_token(i, data.cells[i]);
+        }
+    }
+    set_status(data.status);
+    game_version = data.version;
+}
+
+function show_error(message) {
+    stopped = true;
+    document.getElementById('websocket-closed').classList.add('voro-hide');
+    var error_holder = document.getElementById('game-error');
+    error_holder.textContent = message;
+    error_holder.classList.remove('voro-hide');
+    sock.close();
+}
 
-sock.onclose = function(event) {
-    document.getElementById('websocket-closed').classList.remove('voro-hide');
+function connect() {
+    sock = new WebSocket(socket_url);
+    sock.onopen = function(event) {
+        reconnect_delay = 500;
+        document.getElementById('websocket-closed').classList.add('voro-hide');
+        send_json({action: 'RESUME', version: game_version});
+    };
+    sock.onmessage = function(event) {
+        data = JSON.parse(event.data);
+        console.log(data)
+        if (data.action === 'GAME_DELTA') {
+            apply_delta(data);
+        }
+        if (data.action === 'GAME_SNAPSHOT') {
+            apply_snapshot(data);
+        }
+        if (data.action === 'ERROR') {
+            show_error(data.message);
+        }
+    };
+    sock.onclose = function(event) {
+        if (stopped) {
+            return;
+        }
+        document.getElementById('websocket-closed').classList.remove('voro-hide');
+        setTimeout(connect, reconnect_delay);
+        reconnect_delay = Math.min(reconnect_delay * 2, 30000);
+    };
 }
 
 function send_json(message) {
@@ -74,15 +139,25 @@ function send_json(message) {
     sock.send(raw_message);
 }
 
-var cells = document.getElementsByClassName('voro-cell');
-for (var cell of cells) {
-    cell.addEventListener('click', function() {
-        var color = game_status.to_move;
-        send_json({
-            action: 'PLAY_TOKEN',
-            location: this.dataset.num,
-            color: color,
-        });
-        console.log(this)
+function start_game(cells) {
+    // The board drawing arrives separately; tokens and the socket wait on it.
+    load_board(document.getElementById('board-holder'), function(cell_elements) {
+        for (var i = 0; i < cells.length; i++) {
+            if (cells[i] !== '0') {
+                place_token(i, cells[i]);
+            }
+        }
+        for (var cell of cell_elements) {
+            cell.addEventListener('click', function() {
+                var color = game_status.to_move;
+                send_json({
+                    action: 'PLAY_TOKEN',
+                    location: this.dataset.num,
+                    color: color,
+                });
+                console.log(this)
+            });
+        }
+        connect();
     });
 }
@@ -0,0 +1,110 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Resolves the logged-in user.  Display data for users is shared across
+# requests in a small cache whose entries expire after a TTL, bounding how
+# stale another process's view of a rename can be; changes made through
+# this process invalidate entries immediately.
+
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+from flask import g, session
+from sqlalchemy import event
+
+from web import models
+from web.database import db_session
+
+User = namedtuple('User', ['user_id', 'username', 'display_name'])
+
+class UserCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        user = loader(user_id)
+        if user is None:
+            return None
+        with self._lock:
+            self._users[user_id] = (now + self.ttl, user)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._users),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+cache = UserCache()
+
+def _load_user(user_id):
+    row = (db_session.query(models.User.user_id, models.User.username,
+                            models.User.display_name)
+           .filter_by(user_id=user_id).first())
+    if row is None:
+        return None
+    return User(*row)
+
+def get_user(user_id):
+    if user_id is None:
+        return None
+    return cache.get(int(user_id), _load_user)
+
+def current_user():
+    # Looked up at most once per request; a socket keeps its request
+    # context open, so it resolves its user once too.
+    if 'current_user' not in g:
+        g.current_user = get_user(session.get('user_id'))
+    return g.current_user
+
+def set_current_user(user_id):
+    if user_id is None:
+        session.pop('user_id', None)
+    else:
+        session['user_id'] = user_id
+    g.pop('current_user', None)
+
+@event.listens_for(models.User, 'after_insert')
+@event.listens_for(models.User, 'after_update')
+@event.listens_for(models.User, 'after_delete')
+def _invalidate_user(mapper, connection, target):
+    cache.invalidate(target.user_id)
@@ -16,16 +16,18 @@ import sqlite3
 import flask
 from flask import Flask, Blueprint, render_template, g, request, redirect, url_for, session, current_app
 from flask_sockets import Sockets
-import jinja2
+from markupsafe import Markup
 import click
 import numpy as np
 import io
 import json
 import os
 from functools import wraps
+from sqlalchemy import or_
+from sqlalchemy.orm import load_only
 
-from web.unionfind import UnionFind
-from web import database, models
+from builder import boardformat
+from web import boards, bot, database, live, models, rooms, rules, shards, users
 from web.database import db_session
 
 #getting a lot of false positives on current_app.logger
@@ -49,18 +51,47 @@ def init_db():
 
 @app.cli.command('addboard')
 @click.option('--name', type=str, default=None, help='Name to give the board')
-@click.argument('file', type=click.File('r'))
-def add_board(name, file):
-    board_obj = json.load(file)
+@click.option('--store', type=click.Choice(['binary', 'json']), default='binary',
+              help='Format to store the board in.')
+@click.argument('file', type=click.File('rb'))
+def add_board(name, store, file):
+    data = file.read()
     if name is None:
         name = file.name
-    new_board = models.Board(
-        board_name=name,
-        board_json=json.dumps(board_obj))
+    new_board = models.Board(board_name=name)
+    if store == 'binary':
+        if not boardformat.is_binary(data):
+            board_obj = json.loads(data)
+            data = boardformat.encode(board_obj['tokens'], board_obj['edges'],
+                                      board_obj['num_border'])
+        new_board.num_cells = len(boardformat.decode(data)['coords'])
+        new_board.board_data = data
+    else:
+        board_obj = boardformat.read_any(data)
+        new_board.num_cells = len(board_obj['tokens'])
+        new_board.board_json = json.dumps(board_obj)
     db_session.add(new_board)
     db_session.commit()
     current_app.logger.info("Board added!")
 
+@app.cli.command('convertboards')
+@click.option('--keep-json/--drop-json', default=False,
+              help='Whether to keep board_json after conversion.')
+def convert_boards(keep_json):
+    query = (db_session.query(models.Board)
+             .filter(models.Board.board_data.is_(None))
+             .filter(models.Board.board_json.isnot(None)))
+    converted = 0
+    for board_model in query.all():
+        board_obj = json.loads(board_model.board_json)
+        board_model.board_data = boardformat.encode(
+            board_obj['tokens'], board_obj['edges'], board_obj['num_border'])
+        if not keep_json:
+            board_model.board_json = None
+        converted += 1
+    db_session.commit()
+    current_app.logger.info('Converted %d boards to binary.', converted)
+
 def uses_template(template=None):
     def decorator(f):
         @wraps(f)
@@ -73,58 +104,52 @@ def uses_template(template=None):
         return decorated_function
     return decorator
 
-def layout_board(id):
-    board_model = db_session.query(models.Board).filter_by(board_id=id).first()
-    board = json.loads(board_model.board_json)
-    # with open('board.json', 'r') as f:
-    #     board = json.load(f)
-    trueboard = np.array(board['tokens'])
-    edges = board['edges']
-
-    def edge(i, j):
-        p1 = trueboard[i]
-        p2 = trueboard[j]
-        return {
-            'x1': p1[0]+22,
-            'y1': p1[1]+22,
-            'x2': p2[0]+22,
-            'y2': p2[1]+22,
-        }
-
-    def cell(i):
-        p = trueboard[i]
-        return {
-            'num': i,
-            'x': p[0]+22,
-            'y': p[1]+22,
-        }
-    
-    return {
-        'board_id': id,
-        'board_name': board_model.board_name,
-        'edges': [edge(i, j) for (i, j) in edges],
-        'cells': [cell(i) for i in range(len(trueboard))],
-        'radius': min(np.linalg.norm(trueboard[i]-trueboard[j])
-                      for (i, j) in edges) * 0.45,
-    }
+def board_payload_response(payload, mimetype):
+    if payload is None:
+        flask.abort(404)
+    response = flask.Response(payload.data, mimetype=mimetype)
+    response.set_etag(payload.etag)
+    response.cache_control.public = True
+    if request.args.get('v') == payload.etag:
+        # Pages link to the payload with its hash in the URL, which an edit
+        # to the board changes, so that URL can be kept for good.
+        response.cache_control.max_age = current_app.config['BOARD_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        # Other URLs revalidate, so that an edited board is not served stale.
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.app_template_global()
+def board_geometry_url(board_id):
+    return url_for('voro.board_geometry', id=board_id,
+                   v=boards.get_geometry(board_id).etag)
+
+@app.route('/boards/<int:id>.svg')
+def board_svg(id):
+    return board_payload_response(boards.get_svg(id), 'image/svg+xml')
 
-@app.route('/boards/<id>')
+@app.route('/boards/<int:id>/geometry')
+def board_geometry(id):
+    return board_payload_response(boards.get_geometry(id), 'application/octet-stream')
+
+@app.route('/boards/<int:id>')
 @uses_template('board.html')
 def view_board(id):
-    board = layout_board(id)
-    return board
+    board = boards.get_board(id)
+    if board is None:
+        flask.abort(404)
+    return dict(board_id=board.board_id, board_name=board.board_name)
 
 @app.route('/games/new', methods=['POST'])
 def new_game():
     if 'user_id' not in session:
         #TODO: better interface
         return 'Log in to challenge opponent'
-    user_id = session['user_id']
-    user = db_session.query(models.User).filter_by(user_id=user_id).first()
+    user = users.current_user()
     game_name = request.form.get('game_name', None)
     board_id = int(request.form['board_id'])
-    opponent_id = int(request.form['opponent_id'])
-    opponent = db_session.query(models.User).filter_by(user_id=opponent_id).first()
+    opponent = users.get_user(request.form['opponent_id'])
 
     if user is None or opponent is None:
         return 'Error in user info'
@@ -132,17 +157,17 @@ def new_game():
     if game_name is None:
         game_name = user.display_name + ' vs ' + opponent.display_name
 
-    default_status = json.dumps({
-        'to_move': 1,
-        'moves_left': 1,
-    })
     new_game = models.Game(
         game_name=game_name,
         board_id=board_id,
-        game_status_json=default_status,
-        player1=user,
-        player2=opponent,
+        move_count=0,
+        player1_id=user.user_id,
+        player2_id=opponent.user_id,
     )
+    new_game.set_status({
+        'to_move': 1,
+        'moves_left': 1,
+    })
     db_session.add(new_game)
     db_session.commit()
 
@@ -155,170 +180,290 @@ def set_status_js(json):
     result += json
     result += ')'
     result += '</script>'
-    return jinja2.Markup(result)
+    return Markup(result)
 
 @app.route('/games/<int:id>')
 @uses_template('game.html')
 def view_game(id):
     game = db_session.query(models.Game).filter_by(game_id=id).first()
-    board_id = game.board_id
-    board = layout_board(board_id)
-    board['game_name'] = game.game_name
-    for token in game.tokens:
-        location = token.location
-        player = token.player
-        board['cells'][location]['color'] = player
+    if game is None:
+        flask.abort(404)
+    # Other workers show the last persisted state; the socket catches up.
+    live_game = live.games.get(id, game, keep=shards.shard.owns(id))
     return dict(
-        game_status_json=game.game_status_json,
-        **board)
+        board_id=game.board_id,
+        game_name=game.game_name,
+        cells=live_game.cells(),
+        game_status_json=json.dumps(live_game.status),
+        game_version=live_game.move_count)
+
+def unstored_moves(queued, stored):
+    # The moves from queued, read from the write-behind queue before the
+    # game was, that come after the stored ones.
+    return [move for move in queued if move['move_number'] > stored]
+
+def replay_position(game, move, queued=()):
+    # The cells and status after the given number of moves, rebuilt from
+    # the latest checkpoint at or before it and the moves since, the stored
+    # ones and then those from queued, the moves not stored yet.
+    checkpoint = (db_session.query(models.Checkpoint)
+                  .filter_by(game_id=game.game_id)
+                  .filter(models.Checkpoint.move_number <= move)
+                  .order_by(models.Checkpoint.move_number.desc())
+                  .first())
+    board = boards.get_board(game.board_id)
+    if checkpoint is None:
+        occupancy = np.zeros(board.num_cells, dtype=np.int8)
+        turn = (1, 1)
+        start = 0
+    else:
+        occupancy = np.frombuffer(checkpoint.cells, dtype=np.int8).copy()
+        turn = (checkpoint.to_move, checkpoint.moves_left)
+        start = checkpoint.move_number
+    tokens = (db_session.query(models.Token.location, models.Token.player)
+              .filter_by(game_id=game.game_id)
+              .filter(models.Token.move_number > start)
+              .filter(models.Token.move_number <= move)
+              .order_by(models.Token.move_number))
+    for location, player in tokens:
+        occupancy[location] = player
+        turn = rules.next_turn(*turn)
+    for queued_move in queued:
+        if queued_move['move_number'] > move:
+            break
+        occupancy[queued_move['location']] = queued_move['color']
+        turn = rules.next_turn(*turn)
+    status = {'to_move': turn[0], 'moves_left': turn[1]}
+    if move > 0:
+        status.update(rules.score(board, occupancy))
+    return (occupancy + ord('0')).tobytes().decode(), status
+
+@app.route('/games/<int:id>/replay')
+def replay_game(id):
+    # ?move=<k> for the position after k moves; the latest by default.
+    # Moves still waiting in the write-behind queue are read from it.
+    queued = live.writer.queued(id)
+    game = (db_session.query(models.Game)
+            .options(load_only(models.Game.game_id, models.Game.board_id,
+                               models.Game.move_count))
+            .filter_by(game_id=id).first())
+    if game is None:
+        flask.abort(404)
+    stored = game.move_count or 0
+    queued = unstored_moves(queued, stored)
+    move_count = queued[-1]['move_number'] if queued else stored
+    move = request.args.get('move', move_count, type=int)
+    if not 0 <= move <= move_count:
+        flask.abort(400)
+    cells, status = replay_position(game, move, queued)
+    return dict(game_id=id, version=move, move_count=move_count,
+                cells=cells, status=status)
+
+@app.route('/games/<int:id>/moves')
+def game_moves(id):
+    # The whole move log as newline-delimited JSON, streamed as it is read,
+    # for clients to scrub through: a line with the board, then one per move.
+    # The stored moves are read from the database, and the rest from the
+    # write-behind queue.
+    queued = live.writer.queued(id)
+    game = db_session.query(models.Game).filter_by(game_id=id).first()
+    if game is None:
+        flask.abort(404)
+    stored = game.move_count or 0
+    queued = unstored_moves(queued, stored)
+    move_count = queued[-1]['move_number'] if queued else stored
+    tokens = (db_session.query(models.Token.move_number, models.Token.location,
+                               models.Token.player, models.Token.placed_on)
+              .filter_by(game_id=id)
+              .filter(models.Token.move_number <= stored)
+              .order_by(models.Token.move_number)
+              .yield_per(1000))
+
+    def generate():
+        yield json.dumps({'game_id': id, 'board_id': game.board_id,
+                          'move_count': move_count}) + '\n'
+        for move_number, location, color, placed_on in tokens:
+            yield json.dumps([move_number, location, color,
+                              placed_on.isoformat() if placed_on else None]) + '\n'
+        for move in queued:
+            yield json.dumps([move['move_number'], move['location'], move['color'],
+                              move['placed_on']]) + '\n'
+
+    return flask.Response(flask.stream_with_context(generate()),
+                          mimetype='application/x-ndjson')
+
+def keyset_page(query, key, after):
+    # One page of rows in key order, starting after the key value given, and
+    # the key value the next page starts after (None on the last page).
+    page_size = current_app.config['LIST_PAGE_SIZE']
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(key).limit(page_size + 1).all()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, getattr(rows[-1], key.key)
+
+def page_url(param, after):
+    if after is None:
+        return None
+    args = request.args.to_dict()
+    args[param] = after
+    return url_for(request.endpoint, **request.view_args, **args)
+
+def game_page(player_id=None):
+    # Filters: ?active=1 for unfinished games, ?user=<id> for a player's.
+    query = db_session.query(models.Game).options(
+        load_only(models.Game.game_id, models.Game.game_name))
+    if request.args.get('active', type=int):
+        query = query.filter(models.Game.game_complete == False)
+    if player_id is None:
+        player_id = request.args.get('user', type=int)
+    if player_id is not None:
+        query = query.filter(or_(models.Game.player1_id == player_id,
+                                 models.Game.player2_id == player_id))
+    games, after = keyset_page(query, models.Game.game_id,
+                               request.args.get('games_after', type=int))
+    return games, page_url('games_after', after)
+
+def board_page():
+    # Filters: ?min_cells=<n> and ?max_cells=<n> on board size.
+    query = db_session.query(models.Board).options(
+        load_only(models.Board.board_id, models.Board.board_name,
+                  models.Board.num_cells))
+    min_cells = request.args.get('min_cells', type=int)
+    if min_cells is not None:
+        query = query.filter(models.Board.num_cells >= min_cells)
+    max_cells = request.args.get('max_cells', type=int)
+    if max_cells is not None:
+        query = query.filter(models.Board.num_cells <= max_cells)
+    boards, after = keyset_page(query, models.Board.board_id,
+                                request.args.get('boards_after', type=int))
+    return boards, page_url('boards_after', after)
 
 @app.route('/boards')
 @uses_template('board_list.html')
 def board_list():
-    boards = db_session.query(models.Board).all()
-    games = db_session.query(models.Game).all()
-    return dict(boards=boards, games=games)
+    games, next_games = game_page()
+    boards, next_boards = board_page()
+    return dict(games=games, next_games=next_games,
+                boards=boards, next_boards=next_boards)
 
 @app.route('/')
 @uses_template()
 def home():
     return None
 
-def broadcast(ws, game_id, message):
-    # TODO: understand this, maybe use something less hacky?
-    clients = ws.handler.server.clients.values()
-    for client in clients:
-        if client.game_id != game_id: continue
-        client.ws.send(json.dumps(message))
-
-def check_game(game, game_status):
-    board_model = game.board
-    board = json.loads(board_model.board_json)
-
-    num_cells = len(board['tokens'])
-    edges = board['edges']
-    num_border = board['num_border']
-
-    cells = [None for i in range(num_cells)]
-    for token in game.tokens:
-        cells[token.location] = token.player
-    
-    for i in range(num_border):
-        if cells[i] is None:
-            current_app.logger.info('Border not full')
-            game_status['border_full'] = False
-            return
-    current_app.logger.info('Border full.')
-    game_status['border_full'] = True
-    uf = UnionFind(num_cells)
-    for i in range(num_border):
-        uf.custom_weights[i]=1
-    for (i,j) in edges:
-        if i>=num_border or j>=num_border:
-            continue
-        if cells[i] != cells[j]:
-            continue
-        uf.merge(i,j)
-    num_outer_groups = len(uf.positive_weight_groups()) / 2
-    for (i,j) in edges:
-        if cells[i] != cells[j] or cells[i] is None:
-            continue
-        uf.merge(i,j)
-    remaining_connections = len(uf.positive_weight_groups()) - num_outer_groups - 1
-    game_status['connections_remaining'] = remaining_connections
-    if remaining_connections > 0:
-        return
-    game_status['game_complete'] = True
-    scores = [0, 0]
-    for cell, weight in uf.positive_weight_groups():
-        player = 0 if cells[cell] == 1 else 1
-        if weight > 1:
-            scores[player] += weight
-            scores[1 - player] += 4
-        else:
-            scores[1 - player] += 1
-    game_status['score_1'], game_status['score_2'] = scores
-    current_app.logger.info('Score: %s', scores)
-
-def current_user(game, color):
-    return game.player1 if color==1 else game.player2
-
-def play_token(ws, user, game_id, location, color):
-    game=db_session.query(models.Game).filter_by(game_id=game_id).first()
-
-    game_status = json.loads(game.game_status_json)
-    if game_status['to_move'] != color:
-        return
-    if user is not current_user(game, color):
+def play_token(user_id, game_id, location, color):
+    # Only called in the worker that owns the game.
+    game = live.games.get(game_id)
+    if game is None:
         return
-    
-    query = db_session.query(models.Token)
-    query = query.filter_by(game_id=game_id).filter_by(location=location)
-    if query.count() > 0:
+    move = game.play(user_id, location, color)
+    if move is None:
         return
-    
-    game_status['moves_left'] -= 1
-    if game_status['moves_left'] == 0:
-        game_status['to_move'] = 2 if game_status['to_move'] == 1 else 1
-        game_status['moves_left'] = 2
-    game.tokens.append(models.Token(player=color, location=location))
-    check_game(game, game_status)
-    game.game_status_json=json.dumps(game_status)
-    db_session.commit()
-    message = {
-        'action': 'PLAY_TOKEN',
-        'location': location,
-        'color': color,
+    current_app.logger.info('Game %d status: %s', game_id, game.status)
+    if move['move_number'] % current_app.config['REPLAY_CHECKPOINT_INTERVAL'] == 0:
+        move['cells'] = game.cells()
+    live.writer.submit(move)
+    shards.shard.publish(game_id, {
+        'action': 'GAME_DELTA',
+        'version': game.move_count,
+        'moves': [[location, color]],
+        'status': move['status'],
+    })
+    bot.seat.on_turn(game)
+
+def snapshot_frame(game):
+    return {
+        'action': 'GAME_SNAPSHOT',
+        'version': game.move_count,
+        'cells': game.cells(),
+        'status': game.status,
     }
-    broadcast(ws, game_id, message)
-    message = {
-        'action': 'NEW_GAME_STATUS',
-        'status': game_status
+
+def resume_frame(game_id, version):
+    # The moves a client at the given version is missing, or a snapshot if
+    # it is too far behind (or claims to be ahead, or a negative version).
+    game = live.games.get(game_id)
+    if game is None:
+        return {'action': 'ERROR', 'message': 'No game %d' % game_id}
+    # Also picks up games left on the computer's turn by a restart.
+    bot.seat.on_turn(game)
+    missing = game.move_count - version
+    if (version < 0 or missing < 0
+            or missing > current_app.config['RESUME_MAX_MOVES']):
+        return snapshot_frame(game)
+    return {
+        'action': 'GAME_DELTA',
+        'version': game.move_count,
+        'moves': [list(move) for move in game.moves[version:]],
+        'status': game.status,
     }
-    broadcast(ws, game_id, message)
+
+def handle_message(user, game_id, sender, message):
+    # The game protocol, shared by the gevent and asyncio socket servers.
+    if message['action'] == 'PLAY_TOKEN':
+        location = int(message['location'])
+        color = int(message['color'])
+        shards.shard.play(user.user_id if user else None, game_id, location, color)
+    elif message['action'] == 'RESUME':
+        shards.shard.resume(game_id, int(message['version']), sender)
+    else:
+        current_app.logger.warning('Unknown message %s', message)
 
 @sockets.route('/games/<int:id>')
 def game_socket(ws, id):
     client_address = ws.handler.client_address
-    server = ws.handler.server
-    client = server.clients[client_address]
-    client.game_id = id
-    current_app.logger.info('Opening socket at %s for game %d', client_address, id)
-    current_app.logger.info('Session: %s', session)
-    if 'user_id' in session:
-        user = (db_session.query(models.User)
-        .filter_by(user_id=session['user_id'])
-        .first())
-    else:
-        user = None
-    while not ws.closed:
-        try:
-            raw_message = ws.receive()
-            if raw_message is None:
-                current_app.logger.info('None message received and ignored...')
-                continue
-            message = json.loads(raw_message)
-            if message['action'] == 'PLAY_TOKEN':
-                location = int(message['location'])
-                color = int(message['color'])
-                play_token(ws, user, id, location, color)
-            else:
-                current_app.logger.warning('Unknown message %s', message)
-        except Exception as e:
-            current_app.logger.exception('Error in websocket', e)
-            current_app.logger.warning('Raw message was: %s', raw_message)
-    current_app.logger.info('Closing socket...')
+    sender = rooms.SocketSender(ws,
+                                max_queue=current_app.config['SEND_QUEUE_SIZE'],
+                                max_lag=current_app.config['SEND_MAX_LAG']).start()
+    rooms.registry.join(id, sender)
+    current_app.logger.info('Opening socket at %s for game %d (%d subscribers)',
+                            client_address, id, rooms.registry.subscriber_count(id))
+    user = users.current_user()
+    # The socket's request context lasts as long as the socket, so its
+    # session is closed after every use, returning the connection to the
+    # pool; the next message opens a new one.
+    database.teardown()
+    try:
+        while not ws.closed:
+            try:
+                raw_message = ws.receive()
+                if raw_message is None:
+                    current_app.logger.info('None message received and ignored...')
+                    continue
+                try:
+                    handle_message(user, id, sender, json.loads(raw_message))
+                finally:
+                    database.teardown()
+            except Exception as e:
+                current_app.logger.exception('Error in websocket', e)
+                current_app.logger.warning('Raw message was: %s', raw_message)
+    finally:
+        rooms.registry.leave(id, sender)
+        shards.shard.forget(sender)
+        sender.close()
+    current_app.logger.info('Closing socket (%d subscribers left in game %d, '
+                            'send metrics %s)...',
+                            rooms.registry.subscriber_count(id), id, rooms.metrics)
 
 @app.route('/users')
 @uses_template()
 def user_list():
-    users = db_session.query(models.User).all()
-    return dict(users=users)
+    page, after = keyset_page(
+        db_session.query(models.User).options(
+            load_only(models.User.user_id, models.User.display_name)),
+        models.User.user_id, request.args.get('users_after', type=int))
+    return dict(users=page, next_users=page_url('users_after', after))
 
-@app.route('/users/<id>')
+@app.route('/users/<int:id>')
 @uses_template()
 def user_view(id):
-    user = db_session.query(models.User).filter_by(user_id=id).first()
-    #TODO: current games
-    boards = db_session.query(models.Board).all()
-    return dict(user=user, boards=boards)
+    user = users.get_user(id)
+    if user is None:
+        return dict(user=None)
+    games, next_games = game_page(player_id=id)
+    boards, next_boards = board_page()
+    return dict(user=user, games=games, next_games=next_games,
+                boards=boards, next_boards=next_boards)